@@ -1,6 +1,14 @@
 from numbers import Number
 from searchPlus_better import *
+from array import array
 import copy
+import hashlib
+import heapq
+import os
+import pickle
+import random
+import sqlite3
+import time
 
 line1 = "= = = = = = =\n"
 line2 = "= x . . . . =\n"
@@ -11,18 +19,101 @@ line6 = "= @ . . . . =\n"
 line7 = "= = = = = = =\n"
 grelha = line1 + line2 + line3 + line4 + line5 + line6 + line7
 
+# as outras grelhas do enunciado: duas que a procura por novidade resolve e
+# uma em que a maçã está fechada entre paredes, sem solução
+grelhas_enunciado = [grelha, """\
+= = = = = = = = = = = = = = = = = = =
+= . . . . . . . x . . . . . . . . . =
+= . . . = = . = = = . . . . . . . . =
+= . . . . . . . . . . . . . . . . . =
+= . = = = = = = = = = = = = . . . . =
+= . . . . . . . . . . . . . . . . . =
+= . . . . = = = = = = = . . . . . . =
+= . . . . . . . @ . . . . . . . . . =
+= = = = = = = = = = = = = = = = = = =
+""", """\
+= = = = = = = = = = = = = = = = = = =
+= . . . . . . . x . . . . . = . . . =
+= . . . = = . = = = . . . . = . . . =
+= . . . . . . . . . . . . . = . . . =
+= . = = = = = = = = = = = = = . . . =
+= . . . . . . . . . . . . . = . . . =
+= . . . . = = = = = = = . . = . . . =
+= . . . . . . . @ . . . . . . . . . =
+= = = = = = = = = = = = = = = = = = =
+""", """\
+= = = = = = = = = = = = = = = = = = =
+= . . . . . . = x = . . . . = . . . =
+= . . . = = . = = = . . . . = . . . =
+= . . . . . . . . . . . . . = . . . =
+= . = = = = = = = = = = = = = . . . =
+= . . . . . . . . . . . . . = . . . =
+= . . . . = = = = = = = . . = . . . =
+= . . . . . . . @ . . . . . . . . . =
+= = = = = = = = = = = = = = = = = = =
+"""]
+
 def manhattan(p,q):
     (x1,y1) = p
     (x2,y2) = q
     return abs(x1-x2) + abs(y1-y2)
 
+def zobrist_key(n):
+    """Chave pseudo-aleatória de 64 bits para o inteiro n (splitmix64). Não
+    depende do hash do Python, por isso é a mesma em todas as execuções."""
+    z = (n * 0x9E3779B97F4A7C15 + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return z ^ (z >> 31)
+
+class TabelaZobrist(dict):
+    """Tabela de Zobrist de um tipo de componente (0 corpo, 1 cabeça,
+    2 esforço): a chave de cada célula (x,y) é calculada quando é pedida."""
+
+    def __init__(self, tipo):
+        self.tipo = tipo
+
+    def __missing__(self, pos):
+        x, y = pos
+        key = self[pos] = zobrist_key(((x << 20) + y) * 3 + self.tipo)
+        return key
+
+zobrist_body = TabelaZobrist(0)
+zobrist_head = TabelaZobrist(1)
+zobrist_effort = TabelaZobrist(2) # indexada por (esforço, 0)
+
 class EstadoLagarta(dict): 
+    """O hash é de Zobrist: o XOR das chaves das células do corpo, da célula
+    da cabeça e do esforço. É guardado em zobrist e passo e successors
+    actualizam-no com três XORs em vez de o recalcular; qualquer atribuição
+    state[...] = ... apaga-o e o próximo hash calcula-o de novo."""
+
+    zobrist = None
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.zobrist = None
 
-    def __hash__(self):
-        body_sorted = tuple(sorted(self['body']))
-        head = self['head']
-        effort = self['effort']
-        return hash((body_sorted, head, effort))
+    def chave(self):
+        """O valor de Zobrist de 64 bits do estado (o hash é este valor
+        reduzido pelo Python)."""
+        z = self.zobrist
+        if z is None:
+            z = zobrist_head[self['head']] ^ zobrist_effort[(self['effort'], 0)]
+            for pos in self['body']:
+                z ^= zobrist_body[pos]
+            self.zobrist = z
+        return z
+
+    __hash__ = chave
+
+    def __eq__(self, other):
+        if isinstance(other, EstadoLagarta) and self.chave() != other.chave():
+            return False
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
     
     def __lt__(self,other):
         """Um estado é sempre menor do que qualquer outro, para desempate na fila de prioridades"""
@@ -56,8 +147,10 @@ class MundoLagarta(Problem):
         return data
     
     directions = {"E":(-1, 0), "D":(+1, 0), "C":(0, +1), "B":(0, -1)}  # ortogonals
+    integer_costs = True # custos 1, 2 e 3
 
-    def __init__(self, MundoInicial=grelha, esforco_max=3):
+    def __init__(self, MundoInicial=grelha, esforco_max=3, macros=False, podar=False,
+                 dominancia=False):
         initialStatus = self.process_txt(MundoInicial) # process txt and convert to a dictionary
         self.initial=EstadoLagarta()
         self.initial['head']=initialStatus['head']
@@ -67,8 +160,65 @@ class MundoLagarta(Problem):
         self.walls = initialStatus['walls'] # walls positions
         self.dim = initialStatus['dim'] # maze dimension (do not need to be squared)
         self.emax = esforco_max
-        
+        self.wall_mask = self.mask(self.walls)
+        W, H = self.dim
+        # atributos para as procuras em largura (IW, BFWS): a cabeça em cada
+        # célula, cada esforço e o corpo em cada célula
+        self.num_features = 2*W*H + self.ESFORCOS
+        # com podar=True, dead_end descarta os estados que não chegam à maçã
+        # e conta em podas quantos foram descartados por cada teste
+        self.prunes_dead_ends = podar
+        self.podas = {'estatica': 0, 'corpo': 0}
+        # com dominancia=True, best_first_search descarta os estados dominados
+        # por um já expandido, ver IndiceDominancia
+        self.prunes_dominated = dominancia
+        # com macros=True, cada acção arrasta a queda forçada que provoca: 'D'
+        # seguido de duas quedas é uma só acção, MacroAction(['D','B','B'])
+        self.macros = macros
+
     def actions (self, state):
+        if not self.macros:
+            return self.accoes_simples(state)
+        return [self.queda(self.passo(state, a), a)[0] for a in self.accoes_simples(state)]
+
+    def result (self, state, action):
+        """Aplica a acção, que pode ser uma MacroAction ou uma string de várias
+        acções simples, passo a passo."""
+        for a in action:
+            state = self.passo(state, a)
+        return state
+
+    def queda(self, state, action, cost=0):
+        """Continua a queda forçada em que state pode estar, depois de se ter
+        chegado a ele com action e custo cost: enquanto a célula por baixo da
+        cabeça está livre e a maçã não foi atingida, desce. Devolve o triplo
+        (acção, estado, custo), com action alargada a uma MacroAction se
+        houve queda."""
+        steps = [action]
+        while not self.goal_test(state) and self.accoes_simples(state) == ['B']:
+            state = self.passo(state, 'B')
+            steps.append('B')
+            cost = self.path_cost(cost, None, 'B', state)
+        if len(steps) > 1:
+            action = MacroAction(steps)
+        return action, state, cost
+
+    def cell(self, pos):
+        """Índice da célula (x,y) na grelha."""
+        x, y = pos
+        return y*self.dim[0] + x
+
+    def mask(self, cells):
+        """Inteiro com um bit ligado por cada célula de cells."""
+        m = 0
+        for pos in cells:
+            m |= 1 << self.cell(pos)
+        return m
+
+    def mascara_corpo(self, state):
+        return self.mask(state['body'])
+
+    def accoes_simples(self, state):
         x, y = state['head'] # head position
         b = state['body'] # body
         e = state['effort'] # effort
@@ -111,7 +261,8 @@ class MundoLagarta(Problem):
             
         return sorted(action_list)
     
-    def result (self, state, action):
+    def passo(self, state, action):
+        z = state.chave()
         clone=copy.deepcopy(state)
         x, y = clone['head']
         b = clone['body']
@@ -126,20 +277,54 @@ class MundoLagarta(Problem):
         if (new_pos[0],new_pos[1]-1) in self.walls or (new_pos[0],new_pos[1]-1) in b:
             clone['effort'] = 0
         # body fills previous head position:
+        if (x,y) not in b:
+            z ^= zobrist_body[(x,y)]
         clone['body'].add((x,y))
+        # the hash changes in the head cell, the vacated cell and the effort:
+        clone.zobrist = (z ^ zobrist_head[(x,y)] ^ zobrist_head[new_pos]
+                         ^ zobrist_effort[(e, 0)] ^ zobrist_effort[(clone['effort'], 0)])
         return clone
     
+    def successors(self, state):
+        """Gera os triplos (acção, estado seguinte, custo) de state sem passar
+        pelo deepcopy de passo: cada sucessor só copia o conjunto do corpo.
+        Com macros, as quedas forçadas são seguidas com passo."""
+        x, y = state['head']
+        b = state['body']
+        e = state['effort']
+        z = state.chave() ^ zobrist_head[(x,y)] ^ zobrist_effort[(e, 0)]
+        if (x,y) not in b:
+            z ^= zobrist_body[(x,y)]
+        for action in self.accoes_simples(state):
+            new_pos = (x+self.directions[action][0], y+self.directions[action][1])
+            below_pos = (new_pos[0], new_pos[1]-1)
+            seg = EstadoLagarta()
+            seg['head'] = new_pos
+            seg['body'] = b | {(x,y)}
+            if below_pos in self.walls or below_pos in b:
+                seg['effort'] = 0
+            else:
+                seg['effort'] = e + 1 if action == 'C' else e
+            seg.zobrist = z ^ zobrist_head[new_pos] ^ zobrist_effort[(seg['effort'], 0)]
+            cost = self.path_cost(0, state, action, seg)
+            if self.macros:
+                action, seg, cost = self.queda(seg, action, cost)
+            yield action, seg, cost
+
     def goal_test (self, state):
         return state['head'] == self.goal
 
     def path_cost(self, c, state1, action, state2):
-        if action == 'C':
-            cost_action = 3
-        elif action == 'B':
-            cost_action = 1
-        else:
-            cost_action = 2
-        return c + cost_action
+        # uma MacroAction custa a soma dos seus passos
+        for a in action:
+            if a == 'C':
+                cost_action = 3
+            elif a == 'B':
+                cost_action = 1
+            else:
+                cost_action = 2
+            c += cost_action
+        return c
     
     def display (self, state):
         """Devolve a grelha em modo txt"""
@@ -165,9 +350,10 @@ class MundoLagarta(Problem):
         """Executa uma sequência de acções a partir do estado devolvendo o triplo formado pelo estado, 
         pelo custo acumulado e pelo booleano que indica se o objectivo foi ou não atingido. Se o objectivo 
         for atingido antes da sequência ser atingida, devolve-se o estado e o custo corrente.
-        Há o modo verboso e o não verboso, por defeito."""
+        Há o modo verboso e o não verboso, por defeito. As MacroActions são
+        executadas acção simples a acção simples."""
         cost = 0
-        for a in actions_list:
+        for a in expand_macros(actions_list):
             seg = self.result(state,a)
             cost = self.path_cost(cost,state,a,seg)
             state = seg
@@ -206,6 +392,573 @@ class MundoLagarta(Problem):
         yCost = 3 * abs(yDif) if yDif <= 0 else abs(yDif)
         return hCost + yCost
 
+    # Base de dados de padrões: o custo exacto até à maçã no espaço abstracto
+    # dos pares (célula da cabeça, esforço), guardado numa tabela plana com
+    # a entrada (y*largura + x)*ESFORCOS + esforço (-1 se a maçã é inatingível).
+
+    ESFORCOS = 4 # esforços de 0 a 3, como em actions
+    padroes = None
+
+    def chave_grelha(self):
+        """Identifica a grelha (dimensão, paredes, maçã e lagarta inicial)
+        por um hash que é o mesmo em todas as execuções."""
+        desc = (self.dim, sorted(self.walls), self.goal,
+                self.initial['head'], sorted(self.initial['body']))
+        return hashlib.sha1(repr(desc).encode()).hexdigest()
+
+    def transicoes_abstractas(self, pos, e, corpo):
+        """Gera os triplos (célula, esforço, custo) seguintes a (pos, e) quando
+        do corpo só se sabe que está contido em corpo: cada célula de corpo
+        pode estar ocupada ou livre, e geram-se as duas hipóteses. Todas as
+        transições reais estão aqui, com o mesmo custo."""
+        x, y = pos
+        livre = lambda p: (0 <= p[0] < self.dim[0] and 0 <= p[1] < self.dim[1]
+                           and p not in self.walls)
+        below_pos = (x, y-1)
+        if livre(below_pos):
+            # a cair, o esforço só volta a 0 se houver apoio debaixo da nova posição:
+            below2 = (x, y-2)
+            if not livre(below2):
+                yield below_pos, 0, 1
+            else:
+                yield below_pos, e, 1
+                if below2 in corpo and e > 0:
+                    yield below_pos, 0, 1
+            if below_pos not in corpo:
+                return # não pode haver corpo por baixo, só pode cair
+        new_pos = (x, y+1)
+        if e < 3 and livre(new_pos):
+            # por baixo de new_pos está a cabeça antiga, que não é corpo
+            yield new_pos, e+1, 3
+        for new_pos in ((x+1, y), (x-1, y)):
+            below_pos = (new_pos[0], new_pos[1]-1)
+            if livre(new_pos) and (e == 0 or not livre(below_pos) or below_pos in corpo):
+                yield new_pos, 0, 2
+
+    def celulas_visitaveis(self):
+        """Devolve o par (corpo, cabeca): as células que podem vir a ser corpo
+        (o corpo inicial e as que a cabeça consegue visitar) e as que a cabeça
+        consegue visitar, calculadas em conjunto até estabilizarem com as
+        transições abstractas, que ignoram o corpo."""
+        corpo = set(self.initial['body']) | {self.initial['head']}
+        while True:
+            visitadas = {(self.initial['head'], self.initial['effort'])}
+            fila = list(visitadas)
+            while fila:
+                pos, e = fila.pop()
+                for seg in self.transicoes_abstractas(pos, e, corpo):
+                    if seg[:2] not in visitadas:
+                        visitadas.add(seg[:2])
+                        fila.append(seg[:2])
+            cabeca = {pos for pos, e in visitadas}
+            if cabeca <= corpo:
+                return corpo, cabeca
+            corpo |= cabeca
+
+    def construir_padroes(self):
+        """Calcula a base de dados de padrões com um Dijkstra para trás a
+        partir da maçã no espaço dos pares (célula da cabeça, esforço), com
+        os custos e as regras das paredes, da queda e do esforço. O corpo é
+        ignorado: as células que podem vir a ser corpo são o corpo inicial e
+        as que a cabeça consegue visitar, e para essas admitem-se as duas
+        hipóteses, pelo que o custo abstracto nunca excede o real e a
+        heurística é admissível e consistente."""
+        W, H = self.dim
+        NE = self.ESFORCOS
+        celulas = [(x, y) for y in range(H) for x in range(W) if (x, y) not in self.walls]
+        corpo, _ = self.celulas_visitaveis()
+        inversas = [[] for _ in range(W*H*NE)]
+        for pos in celulas:
+            for e in range(NE):
+                i = (pos[1]*W + pos[0])*NE + e
+                for (x, y), e2, c in self.transicoes_abstractas(pos, e, corpo):
+                    inversas[(y*W + x)*NE + e2].append((i, c))
+        custos = array('l', [-1]) * (W*H*NE)
+        fronteira = [(0, (self.goal[1]*W + self.goal[0])*NE + e) for e in range(NE)]
+        while fronteira:
+            c, j = heapq.heappop(fronteira)
+            if custos[j] >= 0:
+                continue
+            custos[j] = c
+            for i, ci in inversas[j]:
+                if custos[i] < 0:
+                    heapq.heappush(fronteira, (c + ci, i))
+        return custos
+
+    def carregar_padroes(self, ficheiro=None):
+        """Prepara a tabela de h_padroes. Se ficheiro já tem a tabela desta
+        grelha, lê-a de lá; senão calcula-a e, havendo ficheiro, guarda-a."""
+        chave = self.chave_grelha()
+        if ficheiro is not None and os.path.exists(ficheiro):
+            with open(ficheiro, 'rb') as fich:
+                dados = pickle.load(fich)
+            if dados['chave'] == chave:
+                self.padroes = dados['custos']
+                return self.padroes
+        self.padroes = self.construir_padroes()
+        if ficheiro is not None:
+            with open(ficheiro, 'wb') as fich:
+                pickle.dump({'chave': chave, 'custos': self.padroes}, fich)
+        return self.padroes
+
+    def alcanca_maca(self, state):
+        """Verifica se a maçã está na zona de células livres (nem parede nem
+        corpo) ligada à cabeça, alargando a zona em todas as direcções de uma
+        vez com operações de bits. O corpo nunca diminui, por isso se a maçã
+        não está na zona nunca será atingida, nem ignorando a gravidade."""
+        W, H = self.dim
+        livres = ((1 << W*H) - 1) & ~(self.wall_mask | self.mascara_corpo(state))
+        maca = 1 << self.cell(self.goal)
+        zona = 1 << self.cell(state['head'])
+        while not zona & maca:
+            nova = (zona | zona << 1 | zona >> 1 | zona << W | zona >> W) & livres
+            if nova | zona == zona:
+                return False
+            zona |= nova
+        return True
+
+    def dead_end(self, state):
+        """Um estado é um beco sem saída se o par (célula da cabeça, esforço)
+        não chega à maçã nem ignorando o corpo (a base de dados de padrões
+        tem -1), ou se o corpo já separou a cabeça da maçã."""
+        if self.padroes is None:
+            self.carregar_padroes()
+        x, y = state['head']
+        if self.padroes[(y*self.dim[0] + x)*self.ESFORCOS + state['effort']] < 0:
+            self.podas['estatica'] += 1
+            return True
+        if not self.alcanca_maca(state):
+            self.podas['corpo'] += 1
+            return True
+        return False
+
+    def dominance_index(self):
+        return IndiceDominancia(self)
+
+    def features(self, state):
+        """Os atributos verdadeiros em state, como inteiros: a célula da
+        cabeça (0 a W*H-1), o esforço (W*H a W*H+3) e as células do corpo
+        (a partir de W*H+4)."""
+        W, H = self.dim
+        corpo = W*H + self.ESFORCOS
+        atributos = [self.cell(state['head']), W*H + state['effort']]
+        atributos.extend(corpo + self.cell(pos) for pos in state['body'])
+        return atributos
+
+    def compilar(self, pasta=None, limite=1000000):
+        """Enumera uma vez o espaço de estados atingível e devolve-o como um
+        CompiledProblem, sobre o qual correm depois todas as procuras nesta
+        grelha. Com pasta, o grafo fica guardado num ficheiro com o nome da
+        chave da grelha (e do tipo de estado, esforço máximo e macros) e as
+        compilações seguintes da mesma grelha lêem-no em vez de enumerar."""
+        chave = '{}-{}-{}-{}'.format(type(self).__name__, self.chave_grelha(),
+                                     self.emax, int(self.macros))
+        ficheiro = None
+        if pasta is not None:
+            ficheiro = os.path.join(pasta, chave + '.grafo')
+            if os.path.exists(ficheiro):
+                return CompiledProblem.load(ficheiro, self)
+        compilado = CompiledProblem(self, limite)
+        if ficheiro is not None:
+            os.makedirs(pasta, exist_ok=True)
+            compilado.save(ficheiro)
+        return compilado
+
+    def mapa_custos(self, custo_max=infinity):
+        """Custo óptimo até todas as posições possíveis da maçã de uma só vez:
+        uma procura de custo uniforme a partir do estado inicial que não pára
+        na maçã, mas regista para cada célula o primeiro nó (o de menor custo)
+        com a cabeça nela. Termina quando a cabeça já esteve em todas as
+        células de celulas_visitaveis, quando a fronteira se esgota ou quando
+        o custo passa custo_max. Devolve um MapaCustos; as quedas são sempre
+        seguidas passo a passo, mesmo com macros, para nenhuma célula ficar
+        por registar."""
+        if self.macros:
+            def sucessores(state):
+                for action in self.accoes_simples(state):
+                    seg = self.passo(state, action)
+                    yield action, seg, self.path_cost(0, state, action, seg)
+        else:
+            sucessores = self.successors
+        mapa = MapaCustos()
+        falta = self.celulas_visitaveis()[1]
+        node = Node(self.initial)
+        frontier = BucketQueue(min, lambda node: node.path_cost)
+        frontier.append(node)
+        open_nodes = {node.state: node}
+        closed = set()
+        while frontier:
+            node = frontier.pop()
+            if node.path_cost > custo_max:
+                break
+            del open_nodes[node.state]
+            pos = node.state['head']
+            if pos not in mapa.nos:
+                mapa.custos[pos] = node.path_cost
+                mapa.nos[pos] = node
+                falta.discard(pos)
+                if not falta:
+                    break
+            closed.add(node.state)
+            for action, next, cost in sucessores(node.state):
+                if next in closed:
+                    continue
+                child = Node(next, node, action, node.path_cost + cost)
+                incumbent = open_nodes.get(next)
+                if incumbent is None:
+                    frontier.append(child)
+                    open_nodes[next] = child
+                elif child.path_cost < incumbent.path_cost:
+                    del frontier[incumbent]
+                    frontier.append(child)
+                    open_nodes[next] = child
+        return mapa
+
+    def h_padroes(self, node):
+        """Custo até à maçã lido da base de dados de padrões (calculada na
+        primeira chamada se ainda não foi carregada); infinito se a maçã é
+        inatingível a partir da célula e esforço do nó."""
+        if self.padroes is None:
+            self.carregar_padroes()
+        x, y = node.state['head']
+        c = self.padroes[(y*self.dim[0] + x)*self.ESFORCOS + node.state['effort']]
+        return c if c >= 0 else infinity
+
+
+class CacheSolucoes:
+    """Cache persistente, num ficheiro SQLite, dos resultados das procuras
+    *_count em MundoLagarta. A chave é a grelha normalizada (o display do
+    estado inicial), o esforço máximo, a variante do problema (a classe e
+    as opções macros, podar e dominancia), o algoritmo (o nome da função de
+    procura e os argumentos que não são funções) e o nome da heurística; o
+    valor é a lista de acções da solução, o custo e o número de expandidos.
+    As funções são identificadas pelo __qualname__, por isso só as funções e
+    métodos definidos ao nível do módulo ou de uma classe entram na cache:
+    com uma lambda ou uma função local (cujo nome não diz o que calcula) a
+    procura é sempre feita e contada em recusadas.
+
+    >>> import tempfile
+    >>> c = CacheSolucoes(os.path.join(tempfile.mkdtemp(), 'cache.sqlite'))
+    >>> p = MundoLagarta()
+    >>> c.procura(astar_search_plus_count, p, lambda n: p.h_dist(n))[1]
+    14
+    >>> c.procura(astar_search_plus_count, p, lambda n: 0)[1]
+    18
+    >>> c.procura(astar_search_plus_count, p, p.h_dist)[1], c.procura(astar_search_plus_count, p, p.h_dist)[1]
+    (14, 14)
+    >>> c.hits, c.misses, c.recusadas
+    (1, 1, 2)
+    >>> c.fechar()
+    """
+
+    def __init__(self, ficheiro='solucoes_lagarta.sqlite'):
+        self.ligacao = sqlite3.connect(ficheiro)
+        self.ligacao.execute(
+            'CREATE TABLE IF NOT EXISTS solucoes (grelha TEXT, esforco INTEGER,'
+            ' variante TEXT, algoritmo TEXT, heuristica TEXT, accoes TEXT,'
+            ' custo INTEGER, expandidos INTEGER, no_primeiro INTEGER,'
+            ' PRIMARY KEY (grelha, esforco, variante, algoritmo, heuristica))')
+        self.ligacao.commit()
+        self.hits = self.misses = self.invalidas = self.recusadas = 0
+
+    def chave(self, search, problem, args):
+        """A chave de search(problem, *args), ou None se search ou uma das
+        funções em args for anónima."""
+        funcoes = [a for a in args if callable(a)]
+        for funcao in [search] + funcoes:
+            nome = getattr(funcao, '__qualname__', '<>')
+            if '<' in nome:
+                return None
+        outros = [repr(a) for a in args if not callable(a)]
+        variante = '{} macros={} podar={} dominancia={}'.format(
+            type(problem).__name__, problem.macros, problem.prunes_dead_ends,
+            problem.prunes_dominated)
+        algoritmo = '{}({})'.format(search.__name__, ', '.join(outros))
+        heuristica = ', '.join(h.__qualname__ for h in funcoes)
+        return (problem.display(problem.initial), problem.emax, variante, algoritmo, heuristica)
+
+    def verifica(self, problem, accoes, custo):
+        """Confirma com executa que as acções levam do estado inicial à
+        maçã com o custo guardado."""
+        if not accoes:
+            return problem.goal_test(problem.initial) and custo == 0
+        _, c, obj = problem.executa(problem.initial, accoes)
+        return obj and c == custo
+
+    def procura(self, search, problem, *args):
+        """Devolve search(problem, *args), uma procura *_count, tirando-o da
+        cache se lá estiver, no mesmo formato: o nó (refeito a partir das
+        acções guardadas) e o número de expandidos, pela ordem em que search
+        os devolve. Uma entrada cuja solução não passa em verifica é
+        apagada e a procura é feita de novo."""
+        chave = self.chave(search, problem, args)
+        if chave is None:
+            self.recusadas += 1
+            return search(problem, *args)
+        linha = self.ligacao.execute(
+            'SELECT accoes, custo, expandidos, no_primeiro FROM solucoes WHERE grelha = ?'
+            ' AND esforco = ? AND variante = ? AND algoritmo = ? AND heuristica = ?',
+            chave).fetchone()
+        if linha is not None:
+            accoes, custo, expandidos, no_primeiro = linha
+            node = None
+            if accoes is not None:
+                accoes = list(accoes)
+                if self.verifica(problem, accoes, custo):
+                    node = Node(problem.initial)
+                    for a in accoes:
+                        node = node.child_node(problem, a)
+                else:
+                    linha = None
+                    self.invalidas += 1
+            if linha is not None:
+                self.hits += 1
+                return (node, expandidos) if no_primeiro else (expandidos, node)
+        self.misses += 1
+        resultado = search(problem, *args)
+        no_primeiro = not isinstance(resultado[0], int)
+        node, expandidos = resultado if no_primeiro else resultado[::-1]
+        if node is None:
+            accoes = custo = None
+        else:
+            accoes, custo = ''.join(node.solution()), node.path_cost
+        self.ligacao.execute('INSERT OR REPLACE INTO solucoes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             chave + (accoes, custo, expandidos, int(no_primeiro)))
+        self.ligacao.commit()
+        return resultado
+
+    def fechar(self):
+        self.ligacao.close()
+
+
+class MapaCustos:
+    """Resultado de MundoLagarta.mapa_custos: custos[(x,y)] é o custo óptimo
+    para a cabeça chegar a (x,y), ou seja, da solução com a maçã em (x,y), e
+    caminho((x,y)) é a sequência de acções dessa solução, reconstruída só
+    quando é pedida a partir do nó guardado."""
+
+    def __init__(self):
+        self.custos = {}
+        self.nos = {}
+
+    def __getitem__(self, pos):
+        return self.custos[pos]
+
+    def __contains__(self, pos):
+        return pos in self.custos
+
+    def __len__(self):
+        return len(self.custos)
+
+    def caminho(self, pos):
+        return self.nos[pos].solution()
+
+
+class IndiceDominancia:
+    """Os estados expandidos de uma procura, agrupados por (cabeça, esforço),
+    com o corpo como máscara de bits e o custo g. Um estado S alcançado com
+    custo g é dominado por um estado T expandido com a mesma cabeça e esforço
+    se g(T) <= g e corpo(T) é subconjunto de corpo(S), desde que cada célula a
+    mais no corpo de S tenha por cima uma parede ou outra célula do corpo de S.
+    Esta última condição é necessária porque o corpo também dá apoio: uma
+    célula de corpo só serve de apoio a quem está na célula de cima, e se
+    essa está ocupada nunca servirá. Assim tudo o que S pode fazer, T faz com
+    o mesmo custo, e S pode ser descartado."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.expandidos = defaultdict(list)
+
+    def add(self, state, g):
+        self.expandidos[(state['head'], state['effort'])].append(
+            (self.problem.mascara_corpo(state), g))
+
+    def dominated(self, state, g):
+        candidatos = self.expandidos.get((state['head'], state['effort']))
+        if not candidatos:
+            return False
+        corpo = self.problem.mascara_corpo(state)
+        ocupadas = self.problem.wall_mask | corpo
+        W = self.problem.dim[0]
+        for outro, g_outro in candidatos:
+            if g_outro <= g and not outro & ~corpo:
+                if not ((corpo & ~outro) << W) & ~ocupadas:
+                    return True
+        return False
+
+
+class EstadoLagartaBits(tuple):
+    """Estado imutável e compacto da lagarta, o quádruplo (cabeça, corpo,
+    esforço, largura): a cabeça é o índice da célula, y*largura + x, e o corpo
+    é um inteiro com o bit dessa célula ligado para cada segmento. Como é um
+    tuplo de inteiros, o hash e a igualdade são imediatos e não há nada para
+    copiar. state['head'], state['body'] e state['effort'] continuam a dar as
+    coordenadas, o conjunto de células e o esforço, como num EstadoLagarta."""
+
+    __slots__ = ()
+
+    def __new__(cls, head, body, effort, width):
+        return tuple.__new__(cls, (head, body, effort, width))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __getitem__(self, key):
+        if key == 'head':
+            head, _, _, width = self
+            return (head % width, head // width)
+        if key == 'body':
+            _, body, _, width = self
+            cells = set()
+            while body:
+                low = body & -body
+                i = low.bit_length() - 1
+                cells.add((i % width, i // width))
+                body ^= low
+            return frozenset(cells)
+        if key == 'effort':
+            return tuple.__getitem__(self, 2)
+        return tuple.__getitem__(self, key)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class MundoLagartaBits(MundoLagarta):
+    """O mesmo problema que MundoLagarta, mas com estados EstadoLagartaBits:
+    accoes_simples, passo e as heurísticas trabalham com índices de células,
+    as paredes vêm da grelha compilada paredes e o corpo é testado bit a bit,
+    sem tuplos nem cópias do corpo. MundoLagarta continua a testar as paredes
+    no conjunto de tuplos walls: é a representação de referência com que
+    compara_representacoes compara esta.
+
+    >>> p = MundoLagartaBits()
+    >>> p.paredes[p.cell((0, 0))], p.paredes[p.cell(p.goal)]
+    (1, 0)
+    >>> uniform_cost_search(p).path_cost == uniform_cost_search(MundoLagarta()).path_cost
+    True
+    """
+
+    def __init__(self, MundoInicial=grelha, esforco_max=3, macros=False, podar=False,
+                 dominancia=False):
+        super().__init__(MundoInicial, esforco_max, macros, podar, dominancia)
+        W, H = self.dim
+        # a grelha compilada: paredes[i] é 1 se a célula i = y*largura + x é
+        # parede, e moves dá o deslocamento do índice para cada acção
+        self.paredes = bytearray(W*H)
+        for pos in self.walls:
+            if 0 <= pos[0] < W and 0 <= pos[1] < H:
+                self.paredes[self.cell(pos)] = 1
+        self.moves = {"E": -1, "D": +1, "C": +W, "B": -W}
+        self.goal_cell = self.cell(self.goal)
+        self.initial = EstadoLagartaBits(self.cell(self.initial['head']),
+                                         self.mask(self.initial['body']), 0, W)
+
+    def mascara_corpo(self, state):
+        return tuple.__getitem__(state, 1)
+
+    def accoes_simples(self, state):
+        p, b, e, w = state
+        paredes = self.paredes
+        # com a célula de baixo livre, a única acção possível é descer:
+        if not paredes[p - w] and not b >> (p - w) & 1:
+            return ['B']
+        action_list = []
+        if e < 3 and not paredes[p + w] and not b >> (p + w) & 1:
+            action_list.append('C')
+        # D e E: célula livre e, se houver esforço, apoiada por baixo
+        for action, q in (('D', p + 1), ('E', p - 1)):
+            if not paredes[q] and not b >> q & 1:
+                if e == 0 or paredes[q - w] or b >> (q - w) & 1:
+                    action_list.append(action)
+        return action_list
+
+    def passo(self, state, action):
+        p, b, e, w = state
+        q = p + self.moves[action]
+        if self.paredes[q - w] or b >> (q - w) & 1:
+            e = 0
+        elif action == 'C':
+            e += 1
+        return EstadoLagartaBits(q, b | 1 << p, e, w)
+
+    successors = Problem.successors
+
+    def goal_test(self, state):
+        return tuple.__getitem__(state, 0) == self.goal_cell
+
+    def h_dist(self, node):
+        y1, x1 = divmod(tuple.__getitem__(node.state, 0), self.dim[0])
+        x2, y2 = self.goal
+        return abs(x1 - x2) + abs(y1 - y2)
+
+    def h_dist_costs(self, node):
+        y1, x1 = divmod(tuple.__getitem__(node.state, 0), self.dim[0])
+        x2, y2 = self.goal
+        yDif = y1 - y2
+        yCost = 3 * abs(yDif) if yDif <= 0 else abs(yDif)
+        return 2 * abs(x1 - x2) + yCost
+
+
+def grelha_aleatoria(largura, altura, seed=0):
+    """Gera uma grelha de texto largura x altura, rodeada de paredes, com
+    plataformas de parede aleatórias de três em três linhas (com buracos), a
+    lagarta no chão e a maçã numa célula livre ao acaso."""
+    rng = random.Random(seed)
+    linhas = [['=']*largura for _ in range(altura)]
+    for y in range(1, altura-1):
+        for x in range(1, largura-1):
+            if y % 3 == 0 and rng.random() < 0.7:
+                linhas[y][x] = '='
+            elif rng.random() < 0.03:
+                linhas[y][x] = '='
+            else:
+                linhas[y][x] = '.'
+    livres = [(x, y) for y in range(1, altura-1) for x in range(1, largura-1)
+              if linhas[y][x] == '.']
+    cx, cy = rng.choice([pos for pos in livres if pos[1] == altura-2])
+    linhas[cy][cx] = '@'
+    mx, my = rng.choice([pos for pos in livres if pos != (cx, cy)])
+    linhas[my][mx] = 'x'
+    return ''.join(' '.join(linha) + '\n' for linha in linhas)
+
+
+def compara_representacoes(dimensoes=(20, 50, 100, 200), passos=20000, seed=0):
+    """Compara MundoLagarta (tuplos e conjuntos) com MundoLagartaBits (índices,
+    grelha compilada e corpo em bits) em grelhas aleatórias de cada dimensão:
+    os dois dão os mesmos sucessores ao longo de passeios aleatórios com
+    passos passos ao todo, e mede-se o tempo de cada um. Devolve uma lista de
+    (dimensão, segundos com tuplos, segundos com bits)."""
+    linhas = []
+    for n in dimensoes:
+        texto = grelha_aleatoria(n, n, seed)
+        tempos = []
+        caminhos = []
+        for classe in (MundoLagarta, MundoLagartaBits):
+            problem = classe(texto)
+            rng = random.Random(seed)
+            caminho = []
+            inicio = time.perf_counter()
+            state = problem.initial
+            for _ in range(passos):
+                succ = list(problem.successors(state))
+                if not succ:
+                    state = problem.initial
+                    caminho.append(None)
+                    continue
+                action, state, cost = rng.choice(succ)
+                caminho.append((action, state['head'], state['effort'], cost))
+            tempos.append(time.perf_counter() - inicio)
+            caminhos.append(caminho)
+        assert caminhos[0] == caminhos[1], n
+        linhas.append((n, tempos[0], tempos[1]))
+        print('{:4d}x{:<4d} tuplos {:8.4f}s  bits {:8.4f}s  {:5.1f}x'.format(
+            n, n, tempos[0], tempos[1], tempos[0] / tempos[1]))
+    return linhas
+
 
 # Function that ranks the nodes by highest novelty and lowest position
 def rank_nodes(boundary: list[tuple[Node, float]]):
@@ -240,7 +993,119 @@ def updateBoundary(n, boundary, bNodes) -> list[tuple[Node, float]]:
     return ranking[:n]
 
 
-def graph_search_count_novelty(problem, N: int, frontier: list):
+def compara_procuras_largura(grelhas=(grelha,), Ns=(3, 10, 20), classe=MundoLagartaBits):
+    """Compara, em cada grelha, os nós expandidos, o custo e o tempo de IW(1),
+    IW(2), BFWS (com h_dist_costs), graph_search_count_novelty com cada N e
+    astar_search_plus_count com h_dist_costs."""
+    tabela = []
+    for i, texto in enumerate(grelhas):
+        procuras = [('IW(1)', lambda p: iw_search_count(p, 1)),
+                    ('IW(2)', lambda p: iw_search_count(p, 2)),
+                    ('BFWS', lambda p: bfws_search_count(p, p.h_dist_costs))]
+        procuras += [('novidade N={}'.format(N), lambda p, N=N: graph_search_count_novelty(p, N, []))
+                     for N in Ns]
+        procuras.append(('A*', lambda p: astar_search_plus_count(p, p.h_dist_costs)))
+        for nome, procura in procuras:
+            problem = classe(texto)
+            inicio = time.perf_counter()
+            node, expandidos = procura(problem)
+            segundos = time.perf_counter() - inicio
+            tabela.append([i, nome, expandidos, node.path_cost if node else '-',
+                           '{:.4f}'.format(segundos)])
+    print_table(tabela, header=['grelha', 'procura', 'expandidos', 'custo', 'segundos'])
+    return tabela
+
+
+class FronteiraNovidade:
+    """A fronteira de graph_search_count_novelty. Para cada nó guarda a
+    soma das distâncias de Manhattan da sua cabeça às cabeças dos outros
+    nós, que se actualiza em O(N) quando um nó entra ou sai, em vez de se
+    recalcularem as O(N²) distâncias de calc_novelties. A novidade de um nó
+    é essa soma a dividir por len - 1, igual para todos, por isso ordenar
+    por novidade é ordenar por soma. Os empates desfazem-se como em
+    rank_nodes: primeiro a cabeça mais à esquerda, depois a mais abaixo e
+    por fim a ordem de entrada (dois nós com a mesma cabeça têm sempre a
+    mesma soma, e a ordenação estável mantém-nos pela ordem de entrada).
+    O dicionário posicao dá a posição de cada estado nas listas, para o
+    teste de pertença e a remoção serem O(1); a ordem das listas não
+    importa, porque a chave de cada nó inclui a ordem de entrada."""
+
+    def __init__(self):
+        self.nodes = []
+        self.xs = []
+        self.ys = []
+        self.sums = []
+        self.seqs = []
+        self.posicao = {}
+        self.count = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node.state in self.posicao
+
+    def add(self, node):
+        x, y = node.state['head']
+        xs, ys, sums = self.xs, self.ys, self.sums
+        total = 0
+        for i in range(len(xs)):
+            d = abs(xs[i] - x) + abs(ys[i] - y)
+            sums[i] += d
+            total += d
+        self.posicao[node.state] = len(self.nodes)
+        self.nodes.append(node)
+        xs.append(x)
+        ys.append(y)
+        sums.append(total)
+        self.seqs.append(self.count)
+        self.count += 1
+
+    def remove(self, i):
+        """Retira o nó na posição i e devolve-o; o último nó passa para a
+        posição i."""
+        x, y = self.xs[i], self.ys[i]
+        node = self.nodes[i]
+        del self.posicao[node.state]
+        for lista in (self.nodes, self.xs, self.ys, self.sums, self.seqs):
+            ultimo = lista.pop()
+            if i < len(lista):
+                lista[i] = ultimo
+        if i < len(self.nodes):
+            self.posicao[self.nodes[i].state] = i
+        xs, ys, sums = self.xs, self.ys, self.sums
+        for j in range(len(xs)):
+            sums[j] -= abs(xs[j] - x) + abs(ys[j] - y)
+        return node
+
+    def index(self, node):
+        return self.posicao[node.state]
+
+    def chave(self, i):
+        """Menor é melhor: maior novidade, depois menor x, menor y e entrada."""
+        return (-self.sums[i], self.xs[i], self.ys[i], self.seqs[i])
+
+    def novidade(self, i):
+        n = len(self.nodes)
+        return self.sums[i] / (n - 1) if n > 1 else 0.0
+
+    def melhor(self):
+        """O nó com mais novidade, ou None se a fronteira está vazia."""
+        if not self.nodes:
+            return None
+        return self.nodes[min(range(len(self.nodes)), key=self.chave)]
+
+    def corta(self, n):
+        """Deixa só os n melhores nós, retirando os piores (escolhidos com
+        um heap)."""
+        excesso = len(self.nodes) - n
+        if excesso > 0:
+            for i in sorted(heapq.nlargest(excesso, range(len(self.nodes)), key=self.chave),
+                            reverse=True):
+                self.remove(i)
+
+
+def graph_search_count_novelty(problem, N: int, frontier: list, explored=None):
     """
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty list.
@@ -250,29 +1115,98 @@ def graph_search_count_novelty(problem, N: int, frontier: list):
     The maximum number of nodes in the frontier is N.
     The novelty of a node is measured as the average (Manhattan) distance
     between the node state and the states of all other nodes in the frontier.
+    The argument explored is an empty ClosedSet, by default an ExploredSet.
+    The frontier is kept in a FronteiraNovidade, so each step costs O(N)
+    instead of the O(N²) of recomputing calc_novelties; the nodes expanded
+    are the same, in the same order, as with updateBoundary and rank_nodes.
+    Both explored and the frontier are hashed by state, so filtering the
+    children and removing the expanded node take constant time.
     """
     expandidos=0
-    frontier.append(Node(problem.initial))
-    boundary = list(zip(frontier, [0.0]))
-    explored = []
-    while frontier:
-        rankedNodes = rank_nodes(boundary)
-        # print(rankedNodes[0])
-        node, novelty = rankedNodes[0]
+    node = Node(problem.initial)
+    frontier.append(node)
+    boundary = FronteiraNovidade()
+    boundary.add(node)
+    if explored is None:
+        explored = ExploredSet()
+    while node is not None:
         expandidos += 1
         if problem.goal_test(node.state):
             return (node, expandidos)
-        
-        explored.append(node.state)
-        boundaryNodes, _ = zip(*boundary)
-        boundaryNodes = list(boundaryNodes)
-        extension = [child for child in node.expand(problem) if child.state not in explored and child not in boundaryNodes]
 
-        boundary.remove((node, novelty))
-        boundaryNodes.remove(node)
+        explored.add(node.state)
+        extension = [child for child in node.expand(problem) if child.state not in explored and child not in boundary]
+
+        boundary.remove(boundary.index(node))
+        for child in extension:
+            boundary.add(child)
+        # o próximo nó é escolhido antes do corte, com as somas de todos
+        node = boundary.melhor()
+        boundary.corta(N)
 
-        boundaryNodes.extend(extension)
-        boundary = updateBoundary(N, boundary, boundaryNodes)
-        frontier = boundaryNodes
+    return (None,expandidos)
 
-    return (None,expandidos)
\ No newline at end of file
+
+def verifica_procuras(grelhas=grelhas_enunciado, classes=(MundoLagarta, MundoLagartaBits),
+                      compilar=True, limite_compilar=50000):
+    """Verificação de regressão das procuras: em cada grelha, com cada classe
+    e cada combinação das opções macros, podar e dominancia, as procuras
+    óptimas têm de dar o custo de uniform_cost_search (None sem solução), e
+    a solução de qualquer procura, óptima ou não, tem de levar à maçã, com
+    executa, pelo custo que diz ter. Com compilar, também as procuras sobre
+    o CompiledProblem (incluindo a bidireccional), nas grelhas com até
+    limite_compilar estados alcançáveis. Devolve a lista dos
+    falhanços (grelha, classe, opções, procura, custo, custo esperado),
+    vazia se tudo bate certo.
+
+    >>> verifica_procuras()
+    []
+    """
+    opcoes = [{}, {'macros': True}, {'podar': True}, {'dominancia': True},
+              {'podar': True, 'dominancia': True}]
+    falhas = []
+    for i, texto in enumerate(grelhas):
+        for classe in classes:
+            esperado = uniform_cost_search(classe(texto))
+            esperado = esperado and esperado.path_cost
+            for opc in opcoes:
+                p = classe(texto, **opc)
+                optimas = [
+                    ('uniform_cost_search_plus', uniform_cost_search_plus),
+                    ('astar_search h_dist_costs', lambda p: astar_search(p, p.h_dist_costs)),
+                    ('astar_search_plus h_padroes', lambda p: astar_search_plus(p, p.h_padroes)),
+                    ('lazy_astar_search', lambda p: lazy_astar_search(p, [p.h_dist, p.h_padroes])),
+                    ('ida_star_search', lambda p: ida_star_search(p, p.h_padroes, table_size=1000))]
+                outras = [
+                    ('iw_search k=2', lambda p: iw_search(p, 2)),
+                    ('bfws_search', lambda p: bfws_search(p, p.h_dist_costs)),
+                    ('graph_search_count_novelty N=10',
+                     lambda p: graph_search_count_novelty(p, 10, [])[0])]
+                if compilar and not opc:
+                    try:
+                        compilado = CompiledProblem(p, limite_compilar)
+                    except ValueError:
+                        compilado = None
+                    if compilado is not None:
+                        optimas += [
+                            ('CompiledProblem astar_search_plus',
+                             lambda p: astar_search_plus(compilado, p.h_dist_costs)),
+                            ('CompiledProblem bidirectional_search',
+                             lambda p: bidirectional_search(compilado, p.h_padroes))]
+                for nome, procura in optimas + outras:
+                    node = procura(p)
+                    custo = node and node.path_cost
+                    if node is not None:
+                        if node.solution():
+                            _, c, obj = p.executa(p.initial, node.solution())
+                        else:
+                            c, obj = 0, p.goal_test(p.initial)
+                        if not obj or c != custo:
+                            custo = ('executa', c, obj)
+                    if (nome, procura) in optimas and custo != esperado or \
+                            custo is not None and not isinstance(custo, Number):
+                        falhas.append((i, classe.__name__, opc, nome, custo, esperado))
+                custos = p.mapa_custos().custos
+                if custos.get(p.goal) != esperado:
+                    falhas.append((i, classe.__name__, opc, 'mapa_custos', custos.get(p.goal), esperado))
+    return falhas
@@ -6,15 +6,19 @@ functions."""
 
 from utils import (
     is_in, argmin, argmax, argmax_random_tie, probability, weighted_sampler,
-    memoize, print_table, open_data, Stack, FIFOQueue, PriorityQueue, name,
-    distance
+    memoize, print_table, open_data, Stack, FIFOQueue, IndexedStack,
+    IndexedFIFOQueue, PriorityQueue, BucketQueue, name, distance
 )
 
 from collections import defaultdict
+from array import array
+import collections
 import math
+import pickle
 import random
 import sys
 import bisect
+import heapq
 
 infinity = float('inf')
 
@@ -26,7 +30,19 @@ class Problem(object):
     """The abstract class for a formal problem.  You should subclass
     this and implement the methods actions and result, and possibly
     __init__, goal_test, and path_cost. Then you will create instances
-    of your subclass and solve them with the various search functions."""
+    of your subclass and solve them with the various search functions.
+    Set integer_costs to True when every step cost is a non-negative
+    integer, so that searches may use a BucketQueue frontier.
+    Call cache_heuristics() to share heuristic values between searches.
+    Set prunes_dead_ends to True when dead_end can recognize states from
+    which no goal is reachable, and prunes_dominated to True when
+    dominance_index can tell states that are no better than one already
+    expanded, so that best_first_search discards them."""
+
+    integer_costs = False
+    heuristic_cache = None
+    prunes_dead_ends = False
+    prunes_dominated = False
 
     def __init__(self, initial, goal=None):
         """The constructor specifies the initial state, and possibly a goal
@@ -66,10 +82,49 @@ class Problem(object):
         and action. The default method costs 1 for every step in the path."""
         return c + 1
 
+    def successors(self, state):
+        """Yield (action, next_state, step_cost) for each action in state.
+        The graph searches use this instead of Node.expand, so they can
+        reject an explored next_state before building a Node for it.
+        The default goes through actions, result and path_cost (which must
+        be additive); override it when the successors can be produced more
+        cheaply all at once."""
+        for action in self.actions(state):
+            next = self.result(state, action)
+            yield action, next, self.path_cost(0, state, action, next)
+
+    def dead_end(self, state):
+        """Return True if no goal can be reached from state. It must never
+        be True for a state that can reach a goal; it is only called when
+        prunes_dead_ends is set."""
+        return False
+
+    def predecessors(self, state):
+        """Yield (action, previous_state, step_cost) for each way state can
+        be reached: the inverse of successors, used by bidirectional_search
+        to search backwards from the goal."""
+        raise NotImplementedError
+
+    def dominance_index(self):
+        """Return a new, empty index of expanded states for one search, with
+        add(state, g) to record a state expanded at cost g and
+        dominated(state, g) to tell if a state reached at cost g can reach
+        no goal more cheaply than some recorded state. Only called when
+        prunes_dominated is set."""
+        raise NotImplementedError
+
     def value(self, state):
         """For optimization problems, each state has a value.  Hill-climbing
         and related algorithms try to maximize this value."""
         raise NotImplementedError
+
+    def cache_heuristics(self, maxsize=100000):
+        """Opt in to a HeuristicCache for this problem: from now on the
+        informed searches compute each heuristic at most once per state,
+        across all the searches run on this problem. Returns the cache,
+        whose hits and misses can be inspected."""
+        self.heuristic_cache = HeuristicCache(maxsize)
+        return self.heuristic_cache
         
 # ______________________________________________________________________________
 
@@ -114,8 +169,9 @@ class Node:
                                       action, next))
 
     def solution(self):
-        """Return the sequence of actions to go from the root to this node."""
-        return [node.action for node in self.path()[1:]]
+        """Return the sequence of actions to go from the root to this node,
+        with each MacroAction replaced by its steps."""
+        return expand_macros(node.action for node in self.path()[1:])
 
     def path(self):
         """Return a list of nodes forming the path from the root to this node."""
@@ -139,6 +195,147 @@ class Node:
     def __lt__(self,state):
         return True
 
+
+class MacroAction(str):
+
+    """An action that stands for a fixed sequence of primitive actions, for
+    problems that compress a chain of forced moves into one transition. It
+    is the string of its steps joined together (MacroAction(['D', 'B', 'B'])
+    == 'DBB'), and solution() gives back the steps."""
+
+    def __new__(cls, steps):
+        action = str.__new__(cls, ''.join(steps))
+        action.steps = tuple(steps)
+        return action
+
+    def __getnewargs__(self):
+        return (self.steps,)
+
+
+def expand_macros(actions):
+    """Return the list of actions with each MacroAction replaced by its steps."""
+    steps = []
+    for action in actions:
+        if isinstance(action, MacroAction):
+            steps.extend(action.steps)
+        else:
+            steps.append(action)
+    return steps
+
+
+class NodeStore:
+
+    """A search tree kept in columns instead of one Node object per node.
+    Node i has its parent index, action code, path cost, depth and state id
+    at position i of the parent, action, path_cost, depth and state arrays;
+    each distinct state and action is stored once, in states and actions.
+    A dead node (expanded, or only reachable as an ancestor) then costs
+    a few machine words instead of a Python object with a __dict__.
+    store.node(i) gives a StoredNode, which works like a Node; pass
+    store=NodeStore() to best_first_search to search with one."""
+
+    def __init__(self):
+        self.parent = array('i')
+        self.action = array('i')
+        self.path_cost = array('q')
+        self.depth = array('i')
+        self.state = array('i')
+        self.states = []
+        self.state_ids = {}
+        self.actions = []
+        self.action_codes = {}
+
+    def __len__(self):
+        return len(self.parent)
+
+    def intern(self, state):
+        """Return the id of state, adding it to the store if it is new."""
+        i = self.state_ids.get(state)
+        if i is None:
+            i = self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        return i
+
+    def add(self, state, parent=-1, action=None, path_cost=0):
+        """Add a node below the node with index parent (-1 for a root)
+        and return its index."""
+        code = self.action_codes.get(action)
+        if code is None:
+            code = self.action_codes[action] = len(self.actions)
+            self.actions.append(action)
+        try:
+            self.path_cost.append(path_cost)
+        except TypeError:
+            # first non-integer cost: switch the column to floats
+            self.path_cost = array('d', self.path_cost)
+            self.path_cost.append(path_cost)
+        self.parent.append(parent)
+        self.action.append(code)
+        self.depth.append(self.depth[parent] + 1 if parent >= 0 else 0)
+        self.state.append(self.intern(state))
+        return len(self.parent) - 1
+
+    def node(self, i):
+        return StoredNode(self, i)
+
+    def path(self, i):
+        """Return the indices of the nodes from the root down to node i."""
+        path_back = []
+        while i >= 0:
+            path_back.append(i)
+            i = self.parent[i]
+        return list(reversed(path_back))
+
+    def nbytes(self):
+        """Bytes used by the columns (not counting the interned states)."""
+        return sum(column.itemsize * len(column) for column in
+                   (self.parent, self.action, self.path_cost, self.depth, self.state))
+
+
+class StoredNode(Node):
+
+    """A view of node index in a NodeStore, with the same interface as Node.
+    Views are cheap and made on demand; only values set on them, such as f
+    during a best first search, are lost when the view is dropped."""
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def state(self):
+        return self.store.states[self.store.state[self.index]]
+
+    @property
+    def parent(self):
+        parent = self.store.parent[self.index]
+        return StoredNode(self.store, parent) if parent >= 0 else None
+
+    @property
+    def action(self):
+        return self.store.actions[self.store.action[self.index]]
+
+    @property
+    def path_cost(self):
+        return self.store.path_cost[self.index]
+
+    @property
+    def depth(self):
+        return self.store.depth[self.index]
+
+    def child_node(self, problem, action):
+        state = self.state
+        next = problem.result(state, action)
+        cost = problem.path_cost(self.path_cost, state, action, next)
+        return StoredNode(self.store, self.store.add(next, self.index, action, cost))
+
+    def solution(self):
+        store = self.store
+        return expand_macros(store.actions[store.action[i]] for i in store.path(self.index)[1:])
+
+    def path(self):
+        return [StoredNode(self.store, i) for i in self.store.path(self.index)]
+
 # ______________________________________________________________________________
 
 
@@ -177,6 +374,102 @@ class SimpleProblemSolvingAgentProgram:
     def search(self, problem):
         raise NotImplementedError
 
+# ______________________________________________________________________________
+# Closed sets: the states a graph search has already expanded
+
+
+class ClosedSet:
+
+    """The explored (closed) set of a graph search. The backends differ in
+    how much they remember about each state:
+        ExploredSet(): the states themselves, in a hash set.
+        FingerprintSet(): only a 64-bit hash of each state.
+        BoundedExploredSet(maxsize): at most maxsize recently used states.
+    Each supports closed.add(state), state in closed and len(closed)."""
+
+    def add(self, state):
+        raise NotImplementedError
+
+    def __contains__(self, state):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class ExploredSet(ClosedSet):
+
+    """Exact closed set. States that cannot be hashed (e.g. the lists used by
+    NQueensProblem) are kept apart and compared one by one."""
+
+    def __init__(self):
+        self.states = set()
+        self.unhashable = []
+
+    def add(self, state):
+        try:
+            self.states.add(state)
+        except TypeError:
+            if state not in self.unhashable:
+                self.unhashable.append(state)
+
+    def __contains__(self, state):
+        try:
+            return state in self.states
+        except TypeError:
+            return state in self.unhashable
+
+    def __len__(self):
+        return len(self.states) + len(self.unhashable)
+
+
+class FingerprintSet(ClosedSet):
+
+    """Closed set that keeps hash(state) instead of the state, so that large
+    states (a Lagarta body, a board) are not kept alive just to be looked
+    up. Two different states with the same hash are taken to be the same
+    state; with 64-bit hashes this is very unlikely, but if it happens the
+    second state is never expanded."""
+
+    def __init__(self):
+        self.fingerprints = set()
+
+    def add(self, state):
+        self.fingerprints.add(hash(state))
+
+    def __contains__(self, state):
+        return hash(state) in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+class BoundedExploredSet(ClosedSet):
+
+    """Closed set that remembers at most maxsize states, forgetting the least
+    recently added or looked up one. A forgotten state may be expanded again,
+    so memory stays bounded at the price of repeated work (and of expansion
+    counts that differ from an exact closed set)."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.states = collections.OrderedDict()
+
+    def add(self, state):
+        self.states[state] = True
+        self.states.move_to_end(state)
+        if len(self.states) > self.maxsize:
+            self.states.popitem(last=False)
+
+    def __contains__(self, state):
+        if state in self.states:
+            self.states.move_to_end(state)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.states)
+
 # ______________________________________________________________________________
 # Uninformed Search algorithms
 
@@ -208,42 +501,50 @@ def tree_search_count(problem, frontier):
     return (None,expandidos)
 
 
-def graph_search(problem, frontier):
+def graph_search(problem, frontier, explored=None):
     """Search through the successors of a problem to find a goal.
-    The argument frontier should be an empty queue.
+    The argument frontier should be an empty queue; an IndexedStack or
+    IndexedFIFOQueue keeps the `child not in frontier` test O(1).
+    The argument explored is an empty ClosedSet, by default an ExploredSet.
     If two paths reach a state, only use the first one. [Figure 3.7]"""
     frontier.append(Node(problem.initial))
-    explored = list()
+    if explored is None:
+        explored = ExploredSet()
     while frontier:
         node = frontier.pop()
         #print(problem.display(node.state))
         #print('--------------------\n\n')
         if problem.goal_test(node.state):
             return node
-        zz = []
-        #explored.append(node.state)
-        explored = explored + [node.state]
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored and
-                        child not in frontier)
+        explored.add(node.state)
+        for action, next, cost in problem.successors(node.state):
+            if next not in explored:
+                child = Node(next, node, action, node.path_cost + cost)
+                if child not in frontier:
+                    frontier.append(child)
     return None
 
-def graph_search_count(problem, frontier):
+def graph_search_count(problem, frontier, explored=None):
     """Search through the successors of a problem to find a goal.
-    The argument frontier should be an empty queue.
+    The argument frontier should be an empty queue; an IndexedStack or
+    IndexedFIFOQueue keeps the `child not in frontier` test O(1).
+    The argument explored is an empty ClosedSet, by default an ExploredSet.
     If two paths reach a state, only use the first one. [Figure 3.7]"""
     expandidos=0
     frontier.append(Node(problem.initial))
-    explored = set()
+    if explored is None:
+        explored = ExploredSet()
     while frontier:
         node = frontier.pop()
         expandidos+=1
         if problem.goal_test(node.state):
             return (node,expandidos)
         explored.add(node.state)
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored and
-                        child not in frontier)
+        for action, next, cost in problem.successors(node.state):
+            if next not in explored:
+                child = Node(next, node, action, node.path_cost + cost)
+                if child not in frontier:
+                    frontier.append(child)
     return (None,expandidos)
 
 def breadth_first_tree_search(problem):
@@ -261,11 +562,11 @@ def depth_first_tree_search_count(problem):
 
 def depth_first_graph_search(problem):
     """Search the deepest nodes in the search tree first."""
-    return graph_search(problem, Stack())
+    return graph_search(problem, IndexedStack())
 
 def depth_first_graph_search_count(problem):
     """Search the deepest nodes in the search tree first."""
-    return graph_search_count(problem, Stack())
+    return graph_search_count(problem, IndexedStack())
 
 
 def breadth_first_search(problem):
@@ -273,14 +574,17 @@ def breadth_first_search(problem):
     node = Node(problem.initial)
     if problem.goal_test(node.state):
         return node
-    frontier = FIFOQueue()
+    frontier = IndexedFIFOQueue()
     frontier.append(node)
     explored = set()
     while frontier:
         node = frontier.pop()
         explored.add(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+        for action, next, cost in problem.successors(node.state):
+            if next in explored:
+                continue
+            child = Node(next, node, action, node.path_cost + cost)
+            if child not in frontier:
                 if problem.goal_test(child.state):
                     return child
                 frontier.append(child)
@@ -292,82 +596,152 @@ def breadth_first_search_count(problem):
     node = Node(problem.initial)
     if problem.goal_test(node.state):
         return 0,node
-    frontier = FIFOQueue()
+    frontier = IndexedFIFOQueue()
     frontier.append(node)
     explored = set()
     while frontier:
         node = frontier.pop()
         explored.add(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+        for action, next, cost in problem.successors(node.state):
+            if next in explored:
+                continue
+            child = Node(next, node, action, node.path_cost + cost)
+            if child not in frontier:
                 if problem.goal_test(child.state):
                     return len(explored),child
                 frontier.append(child)
     return len(explored),None
 
 
-def best_first_graph_search(problem, f):
-    """Search the nodes with the lowest f scores first.
+def tie_breaker(tie, h=None):
+    """Translate a tie-breaking policy for nodes of equal f into the form
+    PriorityQueue takes: 'lifo' and 'fifo' pass through, 'high-g' prefers
+    the deeper (more expensive) node, 'low-h' prefers the node with the
+    lower h (which must then be given), and any function of the node is
+    used as a secondary key, lowest first. None keeps the queue default."""
+    if tie == 'high-g':
+        return lambda node: -node.path_cost
+    if tie == 'low-h':
+        if h is None:
+            raise ValueError("tie='low-h' needs a heuristic")
+        return h
+    return tie
+
+
+def best_first_search(problem, f, tree=False, reopen=False,
+                      queue=PriorityQueue, stats=None, store=None, tie=None, h=None):
+    """Search the nodes with the lowest f scores first. This is the loop
+    behind every best-first and A* variant below, which are thin wrappers.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
-    There is a subtlety: the line "f = memoize(f, 'f')" means that the f
-    values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
-    f = memoize(f, 'f')
-    node = Node(problem.initial)
-    if problem.goal_test(node.state):
-        return node
-    frontier = PriorityQueue(min, f)
+    f is called once for each node that is kept and the value is stored in
+    node.f, so after doing a best first search you can examine the f values
+    of the path returned.
+    With tree=True repeated states are not detected. Otherwise the frontier
+    keeps only the best node for each state and expanded states are closed;
+    with reopen=True a closed state reached again with a lower f is put
+    back in the frontier, which keeps A* optimal with an inconsistent h.
+    The frontier is a queue(min, key, tie), a PriorityQueue unless told
+    otherwise; tie is a policy for nodes of equal f, see tie_breaker; for
+    tie='low-h' the heuristic is h, or problem.h if h is not given.
+    If stats is a dict it is filled with the 'expanded', 'generated',
+    'reopened', 'pruned', 'dominated' and 'max_frontier' counts: pruned
+    successors are the ones problem.dead_end rejected, when
+    problem.prunes_dead_ends is set, and dominated ones are those that the
+    problem.dominance_index() of a problem with prunes_dominated set
+    found dominated by a closed state. If store is a NodeStore the search
+    tree is kept in it and the nodes are StoredNodes.
+    Returns the goal node or None.
+    Successors come from problem.successors, and a Node is only built for
+    those whose state is not closed."""
+    def make_child(node, action, next, cost):
+        if store is None:
+            return Node(next, node, action, node.path_cost + cost)
+        return store.node(store.add(next, node.index, action, node.path_cost + cost))
+
+    node = Node(problem.initial) if store is None else store.node(store.add(problem.initial))
+    node.f = f(node)
+    if tie == 'low-h' and h is None:
+        h = getattr(problem, 'h', None)
+    frontier = queue(min, lambda node: node.f, tie_breaker(tie, h))
     frontier.append(node)
-    explored = set()
+    open_nodes = {} if tree else {node.state: node}
+    closed = {}
+    dead_end = problem.dead_end if problem.prunes_dead_ends else None
+    dominance = problem.dominance_index() if problem.prunes_dominated and not tree else None
+    expanded = generated = reopened = pruned = dominated = max_frontier = 0
+    result = None
     while frontier:
+        if len(frontier) > max_frontier:
+            max_frontier = len(frontier)
         node = frontier.pop()
         if problem.goal_test(node.state):
-            return node
-        explored.add(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            result = node
+            break
+        expanded += 1
+        if tree:
+            for action, next, cost in problem.successors(node.state):
+                generated += 1
+                if dead_end is not None and dead_end(next):
+                    pruned += 1
+                    continue
+                child = make_child(node, action, next, cost)
+                child.f = f(child)
                 frontier.append(child)
-            elif child in frontier:
-                incumbent = frontier[child]
-                if f(child) < f(incumbent):
-                    del frontier[incumbent]
-                    frontier.append(child)
-    return None
-
-def best_first_graph_search_count(problem, f):
-    """Search the nodes with the lowest f scores first.
-    You specify the function f(node) that you want to minimize; for example,
-    if f is a heuristic estimate to the goal, then we have greedy best
-    first search; if f is node.depth then we have breadth-first search.
-    There is a subtlety: the line "f = memoize(f, 'f')" means that the f
-    values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
-    f = memoize(f, 'f')
-    node = Node(problem.initial)
-    if problem.goal_test(node.state):
-        return (node,len(explored))
-    frontier = PriorityQueue(min, f)
-    frontier.append(node)
-    explored = set()
-    while frontier:
-        node = frontier.pop()
-        #print('Testo se é objectivo, com custo',node.path_cost)
-        #print(node.state)
-        if problem.goal_test(node.state):
-            return (node,len(explored))
-        explored.add(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
-                #print('Sucessor com custo',child.path_cost)
+            continue
+        del open_nodes[node.state]
+        closed[node.state] = node.f
+        if dominance is not None:
+            dominance.add(node.state, node.path_cost)
+        for action, next, cost in problem.successors(node.state):
+            generated += 1
+            closed_f = closed.get(next)
+            if closed_f is not None and not reopen:
+                continue
+            if closed_f is None and next not in open_nodes:
+                if dead_end is not None and dead_end(next):
+                    pruned += 1
+                    continue
+                if dominance is not None and dominance.dominated(next, node.path_cost + cost):
+                    dominated += 1
+                    continue
+            child = make_child(node, action, next, cost)
+            child.f = f(child)
+            if closed_f is not None:
+                if child.f >= closed_f:
+                    continue
+                del closed[next]
+                reopened += 1
+                incumbent = None
+            else:
+                incumbent = open_nodes.get(next)
+            if incumbent is None:
                 frontier.append(child)
-            elif child in frontier:
-                incumbent = frontier[child]
-                if f(child) < f(incumbent):
-                    del frontier[incumbent]
-                    frontier.append(child)
-    return (None,len(explored))
+                open_nodes[next] = child
+            elif child.f < incumbent.f:
+                del frontier[incumbent]
+                frontier.append(child)
+                open_nodes[next] = child
+    if stats is not None:
+        stats.update(expanded=expanded, generated=generated, reopened=reopened,
+                     pruned=pruned, dominated=dominated, max_frontier=max_frontier)
+    return result
+
+
+def best_first_graph_search(problem, f, tie=None, h=None):
+    """Search the nodes with the lowest f scores first; see best_first_search.
+    >>> p = GraphProblem('Arad', 'Bucharest', romania_map)
+    >>> best_first_graph_search(p, lambda node: node.path_cost, tie='low-h').path_cost
+    418
+    """
+    return best_first_search(problem, f, tie=tie, h=h)
+
+def best_first_graph_search_count(problem, f, tie=None, h=None):
+    """As best_first_graph_search, returning (node, number of expanded nodes)."""
+    stats = {}
+    node = best_first_search(problem, f, stats=stats, tie=tie, h=h)
+    return (node, stats['expanded'])
 
 def uniform_cost_search(problem):
     """[Figure 3.14]"""
@@ -378,109 +752,54 @@ def uniform_cost_search_count(problem):
     """[Figure 3.14]"""
     return best_first_graph_search_count(problem, lambda node: node.path_cost)
 
-def best_first_graph_search_plus(problem, f):
-    """Search the nodes with the lowest f scores first.
-    You specify the function f(node) that you want to minimize; for example,
-    if f is a heuristic estimate to the goal, then we have greedy best
-    first search; if f is node.depth then we have breadth-first search.
-    There is a subtlety: the line "f = memoize(f, 'f')" means that the f
-    values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
-    f = memoize(f, 'f')
-    node = Node(problem.initial)
-    if problem.goal_test(node.state):
-        return node
-    frontier = PriorityQueue(min, f)
-    frontier.append(node)
-    explored = set()
-    visited_not_explored={node.state}
-    while frontier:
-        node = frontier.pop()
-        if problem.goal_test(node.state):
-            return node
-        explored.add(node.state)
-        visited_not_explored.remove(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored:
-                if child.state not in visited_not_explored:
-                    frontier.append(child)
-                    visited_not_explored.add(child.state)
-                else:
-                    incumbent = frontier[child]
-                    if f(child) < f(incumbent):
-                        del frontier[incumbent]
-                        frontier.append(child)
-    return None
+def best_first_graph_search_plus(problem, f, queue=PriorityQueue, reopen=False, tie=None, h=None):
+    """Search the nodes with the lowest f scores first; see best_first_search.
+    The frontier is a queue(min, f), a PriorityQueue unless told otherwise."""
+    return best_first_search(problem, f, reopen=reopen, queue=queue, tie=tie, h=h)
+
+def integer_queue(problem, f):
+    """Return BucketQueue if the problem declares integer step costs and f
+    is integral at the initial state, or PriorityQueue otherwise. That is
+    only a guess about the other states; if f turns out not to be integral
+    somewhere, BucketQueue moves its items to a PriorityQueue.
+    >>> p = GraphProblem('Arad', 'Bucharest', romania_map)
+    >>> integer_queue(p, lambda node: node.path_cost).__name__
+    'BucketQueue'
+    >>> astar_search_plus(p, lambda node: 0 if node.state == 'Arad' else 0.5).path_cost
+    418
+    """
+    if problem.integer_costs and isinstance(f(Node(problem.initial)), int):
+        return BucketQueue
+    return PriorityQueue
+
 
 def uniform_cost_search_plus(problem):
     """[Figure 3.14]"""
-    return best_first_graph_search_plus(problem, lambda node: node.path_cost)
+    f = lambda node: node.path_cost
+    return best_first_graph_search_plus(problem, f, integer_queue(problem, f))
 
-def best_first_graph_search_plus_count(problem, f):
-    """Search the nodes with the lowest f scores first.
-    You specify the function f(node) that you want to minimize; for example,
-    if f is a heuristic estimate to the goal, then we have greedy best
-    first search; if f is node.depth then we have breadth-first search.
-    There is a subtlety: the line "f = memoize(f, 'f')" means that the f
-    values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
-    f = memoize(f, 'f')
-    node = Node(problem.initial)
-    if problem.goal_test(node.state):
-        return node,0
-    frontier = PriorityQueue(min, f)
-    frontier.append(node)
-    explored = set()
-    visited_not_explored={node.state}
-    while frontier:
-        node = frontier.pop()
-        if problem.goal_test(node.state):
-            return node,len(explored)
-        explored.add(node.state)
-        visited_not_explored.remove(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored:
-                if child.state not in visited_not_explored:
-                    frontier.append(child)
-                    visited_not_explored.add(child.state)
-                else:
-                    incumbent = frontier[child]
-                    if f(child) < f(incumbent):
-                        del frontier[incumbent]
-                        frontier.append(child)
-    return None, len(explored)
+def best_first_graph_search_plus_count(problem, f, queue=PriorityQueue, reopen=False, tie=None, h=None):
+    """As best_first_graph_search_plus, returning (node, number of expanded nodes)."""
+    stats = {}
+    node = best_first_search(problem, f, reopen=reopen, queue=queue, stats=stats, tie=tie, h=h)
+    return node, stats['expanded']
 
 
 def uniform_cost_search_plus_count(problem):
     """[Figure 3.14]"""
-    return best_first_graph_search_plus_count(problem, lambda node: node.path_cost)
+    f = lambda node: node.path_cost
+    return best_first_graph_search_plus_count(problem, f, integer_queue(problem, f))
 
 
 
 # em árvore o Best First e o A*
 
-def best_first_tree_search_count(problem, f):
-    """Search the nodes with the lowest f scores first.
-    You specify the function f(node) that you want to minimize; for example,
-    if f is a heuristic estimate to the goal, then we have greedy best
-    first search; if f is node.depth then we have breadth-first search.
-    There is a subtlety: the line "f = memoize(f, 'f')" means that the f
-    values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
-    f = memoize(f, 'f')
-    explored=0
-    node = Node(problem.initial)
-    if problem.goal_test(node.state):
-        return node,explored
-    frontier = PriorityQueue(min, f)
-    frontier.append(node)
-    while frontier:
-        node = frontier.pop()
-        if problem.goal_test(node.state):
-            return node,explored
-        explored+=1
-        frontier.extend(child for child in node.expand(problem))
-    return None,explored
+def best_first_tree_search_count(problem, f, tie=None, h=None):
+    """Best first search without repeated-state detection; returns
+    (node, number of expanded nodes). See best_first_search."""
+    stats = {}
+    node = best_first_search(problem, f, tree=True, stats=stats, tie=tie, h=h)
+    return node, stats['expanded']
 
 
 # -----------------------------------------------------------------------------------------------
@@ -515,126 +834,457 @@ def iterative_deepening_search(problem):
 
 # ______________________________________________________________________________
 # Bidirectional Search
-# Pseudocode from https://webdocs.cs.ualberta.ca/%7Eholte/Publications/MM-AAAI2016.pdf
-
-def bidirectional_search(problem):
-    e = problem.find_min_edge()
-    gF, gB = {problem.initial : 0}, {problem.goal : 0}
-    openF, openB = [problem.initial], [problem.goal]
-    closedF, closedB = [], []
-    U = infinity
-
-
-    def extend(U, open_dir, open_other, g_dir, g_other, closed_dir):
-        """Extend search in given direction"""
-        n = find_key(C, open_dir, g_dir)
-
-        open_dir.remove(n)
-        closed_dir.append(n)
-
-        for c in problem.actions(n):
-            if c in open_dir or c in closed_dir:
-                if g_dir[c] <= problem.path_cost(g_dir[n], n, None, c):
-                    continue
-
-                open_dir.remove(c)
-
-            g_dir[c] = problem.path_cost(g_dir[n], n, None, c)
-            open_dir.append(c)
-
-            if c in open_other:
-                U = min(U, g_dir[c] + g_other[c])
-
-        return U, open_dir, closed_dir, g_dir
+# MM, from https://webdocs.cs.ualberta.ca/%7Eholte/Publications/MM-AAAI2016.pdf
+
+
+class MMFrontier:
+
+    """One direction of bidirectional_search: the best g and the parent link
+    of every state generated, the open states, the heuristic value of each
+    state (computed once) and three heaps over the open states, ordered by
+    the MM priority max(f, 2g) then g, by f and by g. Entries of states that
+    were closed or reached again more cheaply are dropped when they reach
+    the top of a heap."""
+
+    def __init__(self, h):
+        self.h = h
+        self.hs = {}
+        self.g = {}
+        self.parent = {}
+        self.open = set()
+        self.heaps = ([], [], [])
+        self.counter = 0
+
+    def add(self, state, g, parent):
+        """Open state, reached at cost g from parent. States the heuristic
+        puts at infinity are not opened."""
+        h = self.hs.get(state)
+        if h is None:
+            h = self.hs[state] = self.h(Node(state))
+        if h == infinity:
+            return
+        self.g[state] = g
+        self.parent[state] = parent
+        self.open.add(state)
+        self.counter += 1
+        f = g + h
+        for heap, key in zip(self.heaps, (max(f, 2*g), f, g)):
+            heapq.heappush(heap, (key, g, self.counter, state))
+
+    def top(self, i):
+        """The entry with the least key in heap i, or None if none is open."""
+        heap = self.heaps[i]
+        while heap:
+            key, g, _, state = heap[0]
+            if state in self.open and self.g[state] == g:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def minimum(self, i):
+        entry = self.top(i)
+        return infinity if entry is None else entry[0]
+
+    def pop(self):
+        """Close and return the open state of least priority."""
+        state = self.top(0)[3]
+        self.open.remove(state)
+        return state
 
 
-    def find_min(open_dir, g):
-        """Finds minimum priority, g and f values in open_dir"""
-        m, m_f = infinity, infinity
-        for n in open_dir:
-            f = g[n] + problem.h(n)
-            pr = max(f, 2*g[n])
-            m = min(m, pr)
-            m_f = min(m_f, f)
+def bidirectional_search(problem, h=None, hb=None, stats=None):
+    """MM bidirectional search, which meets in the middle: a forward search
+    from problem.initial with heuristic h (default problem.h) and a
+    backward search from problem.goal (a state or a list of states) with
+    heuristic hb, an estimate of the cost from a state back to the initial
+    state (default 0), along problem.predecessors. Each step expands the
+    open state of least max(f, 2g) in either direction. With admissible
+    heuristics the path found is optimal; it is returned as a Node, or None
+    if there is none. If a stats dict is given, it is filled with the
+    number of expanded and generated nodes."""
+    h = h or problem.h
+    hb = hb or (lambda node: 0)
+    e = problem.find_min_edge() if hasattr(problem, 'find_min_edge') else 0
+    goals = problem.goal if isinstance(problem.goal, list) else [problem.goal]
+    forward, backward = MMFrontier(h), MMFrontier(hb)
+    forward.add(problem.initial, 0, None)
+    for goal in goals:
+        backward.add(goal, 0, None)
+    U, meet = infinity, None
+    if problem.initial in backward.g:
+        U, meet = 0, problem.initial
+    expanded = generated = 0
+
+    while forward.open and backward.open:
+        pr_f, pr_b = forward.minimum(0), backward.minimum(0)
+        C = min(pr_f, pr_b)
+        if U <= max(C, forward.minimum(1), backward.minimum(1),
+                    forward.minimum(2) + backward.minimum(2) + e):
+            break
+        if pr_f <= pr_b:
+            this, other, expand = forward, backward, problem.successors
+        else:
+            this, other, expand = backward, forward, problem.predecessors
+        state = this.pop()
+        expanded += 1
+        for action, next, cost in expand(state):
+            generated += 1
+            g = this.g[state] + cost
+            if this.g.get(next, infinity) <= g:
+                continue
+            this.add(next, g, (state, action, cost))
+            if next in other.g and g + other.g[next] < U:
+                U, meet = g + other.g[next], next
+
+    if stats is not None:
+        stats.update(expanded=expanded, generated=generated)
+    if meet is None:
+        return None
+    steps = []
+    state = meet
+    while forward.parent[state] is not None:
+        previous, action, cost = forward.parent[state]
+        steps.append((state, action, cost))
+        state = previous
+    node = Node(state)
+    for state, action, cost in reversed(steps):
+        node = Node(state, node, action, node.path_cost + cost)
+    state = meet
+    while backward.parent[state] is not None:
+        state, action, cost = backward.parent[state]
+        node = Node(state, node, action, node.path_cost + cost)
+    return node
 
-        return m, m_f, min(g.values())
+# ______________________________________________________________________________
+# Informed (Heuristic) Search
 
 
-    def find_key(pr_min, open_dir, g):
-        """Finds key in open_dir with value equal to pr_min
-        and minimum g value."""
-        m = infinity
-        state = -1
-        for n in open_dir:
-            pr = max(g[n] + problem.h(n), 2*g[n])
-            if pr == pr_min:
-                if g[n] < m:
-                    m = g[n]
-                    state = n
+greedy_best_first_graph_search = best_first_graph_search
+# Greedy best-first search is accomplished by specifying f(n) = h(n).
 
-        return state
 
+class HeuristicCache:
 
-    while openF and openB:
-        pr_min_f, f_min_f, g_min_f = find_min(openF, gF)
-        pr_min_b, f_min_b, g_min_b = find_min(openB, gB)
-        C = min(pr_min_f, pr_min_b)
+    """Heuristic values keyed by (heuristic, state), shared by every search
+    on a problem (see Problem.cache_heuristics). Holds at most maxsize
+    values and evicts the least recently used one; hits and misses count
+    the lookups. States must be hashable."""
 
-        if U <= max(C, f_min_f, f_min_b, g_min_f + g_min_b + e):
-            return U
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.values = collections.OrderedDict()
+        self.hits = self.misses = 0
 
-        if C == pr_min_f:
-            # Extend forward
-            U, openF, closedF, gF = extend(U, openF, openB, gF, gB, closedF)
-        else:
-            # Extend backward
-            U, openB, closedB, gB = extend(U, openB, openF, gB, gF, closedB)
+    def wrap(self, h):
+        """Return h(node) looked up in the cache by node.state."""
+        def cached_h(node):
+            key = (h, node.state)
+            try:
+                value = self.values[key]
+            except KeyError:
+                self.misses += 1
+                value = self.values[key] = h(node)
+                if len(self.values) > self.maxsize:
+                    self.values.popitem(last=False)
+                return value
+            self.hits += 1
+            self.values.move_to_end(key)
+            return value
+        return cached_h
+
+    def clear(self):
+        self.values.clear()
+        self.hits = self.misses = 0
 
-    return infinity
+    def __len__(self):
+        return len(self.values)
 
-# ______________________________________________________________________________
-# Informed (Heuristic) Search
+    def __repr__(self):
+        return '<HeuristicCache {} values, {} hits, {} misses>'.format(
+            len(self.values), self.hits, self.misses)
 
 
-greedy_best_first_graph_search = best_first_graph_search
-# Greedy best-first search is accomplished by specifying f(n) = h(n).
+def cached_heuristic(problem, h):
+    """Return h, going through the problem's HeuristicCache if it has one."""
+    if problem.heuristic_cache is None:
+        return h
+    return problem.heuristic_cache.wrap(h)
 
 
-def astar_search(problem, h=None):
+def astar_search(problem, h=None, tie=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
-    else in your Problem subclass."""
-    h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n))
+    else in your Problem subclass. tie orders nodes of equal f: 'lifo'
+    (the default), 'fifo', 'high-g', 'low-h' or a function of the node."""
+    h = memoize(cached_heuristic(problem, h or problem.h), 'h')
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n),
+                                   tie_breaker(tie, h))
 
-def astar_search_tree_count(problem, h=None):
+def astar_search_tree_count(problem, h=None, tie=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
-    else in your Problem subclass."""
-    h = memoize(h or problem.h, 'h')
-    return best_first_tree_search_count(problem, lambda n: n.path_cost + h(n))
+    else in your Problem subclass. tie orders nodes of equal f: 'lifo'
+    (the default), 'fifo', 'high-g', 'low-h' or a function of the node."""
+    h = memoize(cached_heuristic(problem, h or problem.h), 'h')
+    return best_first_tree_search_count(problem, lambda n: n.path_cost + h(n),
+                                        tie_breaker(tie, h))
 
 
-def astar_search_plus_count(problem, h=None):
+def astar_search_plus_count(problem, h=None, tie=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
-    else in your Problem subclass."""
-    h = memoize(h or problem.h, 'h')
-    return best_first_graph_search_plus_count(problem, lambda n: n.path_cost + h(n))
-
-def astar_search_plus(problem, h=None):
+    else in your Problem subclass. tie orders nodes of equal f: 'lifo'
+    (the default), 'fifo', 'high-g', 'low-h' or a function of the node."""
+    h = memoize(cached_heuristic(problem, h or problem.h), 'h')
+    f = lambda n: n.path_cost + h(n)
+    return best_first_graph_search_plus_count(problem, f, integer_queue(problem, f),
+                                              tie=tie_breaker(tie, h))
+
+def astar_search_plus(problem, h=None, tie=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
-    else in your Problem subclass."""
-    h = memoize(h or problem.h, 'h')
-    return best_first_graph_search_plus(problem, lambda n: n.path_cost + h(n))
+    else in your Problem subclass. tie orders nodes of equal f: 'lifo'
+    (the default), 'fifo', 'high-g', 'low-h' or a function of the node."""
+    h = memoize(cached_heuristic(problem, h or problem.h), 'h')
+    f = lambda n: n.path_cost + h(n)
+    return best_first_graph_search_plus(problem, f, integer_queue(problem, f),
+                                        tie=tie_breaker(tie, h))
+
+
+def lazy_astar_search(problem, hs=None, tie=None, stats=None):
+    """A* that puts off its expensive heuristics (Lazy A*). hs is a list of
+    heuristics in the order they should be tried, cheapest first; by
+    default [problem.h]. A child is queued on f = g + hs[0](child); the
+    next heuristic in the list is only computed when the node reaches the
+    front of the frontier, and if it raises f (f is the max over the
+    heuristics computed so far) the node goes back into the frontier
+    instead of being expanded. Most generated nodes never reach the front,
+    so their expensive heuristics are never computed.
+    As in best_first_search, a node whose f is infinite is still queued,
+    behind all the others, and successors are only pruned by
+    problem.dead_end, when problem.prunes_dead_ends is set.
+    A frontier node reached again by a cheaper path keeps the heuristic
+    values already computed for it. tie is as for astar_search; 'low-h'
+    uses the highest h computed so far for each node. If stats is a dict
+    it is filled with the 'expanded', 'generated', 'reinserted' and
+    'pruned' (rejected by dead_end) counts, and with 'calls', the number
+    of nodes each heuristic was computed for, and 'avoided', the number of
+    queued nodes each heuristic was not needed for.
+    >>> p = GraphProblem('Arad', 'Bucharest', romania_map)
+    >>> lazy_astar_search(p, [lambda node: 0, lambda node: p.h(node) * 1.0]).path_cost
+    418
+    >>> p = GraphProblem('A', 'B', Graph({'A': {'B': 3, 'C': 1}, 'C': {'D': 1}, 'D': {'B': 1}}))
+    >>> lazy_astar_search(p, [p.h]).path_cost
+    3
+    >>> p = GraphProblem('Arad', 'Bucharest', romania_map)
+    >>> lazy_astar_search(p, tie='low-h').path_cost
+    418
+    """
+    hs = [cached_heuristic(problem, h) for h in (hs or [problem.h])]
+    calls = [0] * len(hs)
+
+    def new_node(state, parent=None, action=None, path_cost=0):
+        node = Node(state, parent, action, path_cost)
+        node.level = 1
+        node.f = path_cost + hs[0](node)
+        calls[0] += 1
+        return node
+
+    queue = integer_queue(problem, lambda node: node.path_cost + hs[0](node))
+    # for tie='low-h', the highest h computed so far for the node
+    frontier = queue(min, lambda node: node.f,
+                     tie_breaker(tie, lambda node: node.f - node.path_cost))
+    node = new_node(problem.initial)
+    frontier.append(node)
+    open_nodes = {node.state: node}
+    closed = set()
+    dead_end = problem.dead_end if problem.prunes_dead_ends else None
+    expanded = generated = reinserted = pruned = 0
+    result = None
+    while frontier:
+        node = frontier.pop()
+        if problem.goal_test(node.state):
+            result = node
+            break
+        raised = False
+        while node.level < len(hs):
+            f = node.path_cost + hs[node.level](node)
+            calls[node.level] += 1
+            node.level += 1
+            if f > node.f:
+                node.f = f
+                raised = True
+                break
+        if raised:
+            frontier.append(node)
+            reinserted += 1
+            continue
+        expanded += 1
+        del open_nodes[node.state]
+        closed.add(node.state)
+        for action, next, cost in problem.successors(node.state):
+            generated += 1
+            if next in closed:
+                continue
+            incumbent = open_nodes.get(next)
+            g = node.path_cost + cost
+            if incumbent is None:
+                if dead_end is not None and dead_end(next):
+                    pruned += 1
+                    continue
+                child = new_node(next, node, action, g)
+            elif g < incumbent.path_cost:
+                # same state, same heuristic values: reuse them
+                child = Node(next, node, action, g)
+                child.level = incumbent.level
+                child.f = incumbent.f - incumbent.path_cost + g
+                del frontier[incumbent]
+            else:
+                continue
+            frontier.append(child)
+            open_nodes[next] = child
+    if stats is not None:
+        stats.update(expanded=expanded, generated=generated, reinserted=reinserted,
+                     pruned=pruned, calls=calls, avoided=[calls[0] - c for c in calls])
+    return result
+
+def compare_tie_breaking(problems, h_names=('h',),
+                         ties=('lifo', 'fifo', 'high-g', 'low-h')):
+    """Print a table with the nodes expanded by astar_search_plus_count on
+    each problem, for each heuristic (a method name of the problem) and
+    tie-breaking policy, and the cost found, which must not change."""
+    table = []
+    for i, problem in enumerate(problems):
+        for h_name in h_names:
+            row = ['{} {}'.format(i, h_name)]
+            for tie in ties:
+                node, expanded = astar_search_plus_count(problem, getattr(problem, h_name), tie)
+                row.append('{} ({})'.format(expanded, node.path_cost if node else '-'))
+            table.append(row)
+    print_table(table, header=['problem h'] + list(ties))
+
+# ______________________________________________________________________________
+# Width-based search: IW(k) and BFWS
+# A problem used here provides features(state), an iterable of ints below
+# problem.num_features naming the atoms (features) true in state.
+
+
+class NoveltyTable:
+
+    """The tuples of at most k features (k is 1 or 2) seen so far, out of n
+    features, as bits: feature f is bit f of a bytearray of n bits; when
+    k == 2 the pair f < g is bit g - f - 1 of the row of f, a bytearray of
+    n - f - 1 bits made the first time f is seen with a greater feature.
+    So the pairs take a triangle, not a square, and only the rows of the
+    features seen are ever allocated."""
+
+    def __init__(self, num_features, k=1):
+        if k not in (1, 2):
+            raise ValueError('NoveltyTable supports k = 1 or 2, got {}'.format(k))
+        self.n = num_features
+        self.k = k
+        self.bits = bytearray((num_features + 7) // 8)
+        self.rows = {}
+
+    @staticmethod
+    def mark(bits, i):
+        """Set bit i of the bytearray bits; return True if it was not set."""
+        byte, bit = i >> 3, 1 << (i & 7)
+        if bits[byte] & bit:
+            return False
+        bits[byte] |= bit
+        return True
+
+    def novelty(self, features):
+        """Mark every tuple of at most k of the features as seen and return
+        the size of the smallest one that had not been seen, or k + 1 if
+        all had."""
+        w = self.k + 1
+        if self.k == 1:
+            for f in features:
+                if self.mark(self.bits, f):
+                    w = 1
+            return w
+        features = sorted(set(features))
+        last = len(features) - 1
+        for a, f in enumerate(features):
+            if self.mark(self.bits, f):
+                w = 1
+            if a == last:
+                break
+            row = self.rows.get(f)
+            if row is None:
+                row = self.rows[f] = bytearray((self.n - f + 6) // 8)
+            for g in features[a + 1:]:
+                if self.mark(row, g - f - 1) and w > 2:
+                    w = 2
+        return w
+
+
+def iw_search_count(problem, k=1, features=None):
+    """IW(k), iterated width: a breadth-first search that prunes every
+    generated state that does not make some tuple of at most k features
+    true for the first time in the search. It expands at most
+    num_features**k nodes, but is incomplete: the goal may be pruned away.
+    features defaults to problem.features. Returns (node, number of
+    expanded nodes), with node None if the goal was not reached."""
+    features = features or problem.features
+    table = NoveltyTable(problem.num_features, k)
+    node = Node(problem.initial)
+    table.novelty(features(node.state))
+    if problem.goal_test(node.state):
+        return node, 0
+    frontier = collections.deque([node])
+    expanded = 0
+    while frontier:
+        node = frontier.popleft()
+        expanded += 1
+        for action, next, cost in problem.successors(node.state):
+            if table.novelty(features(next)) > k:
+                continue
+            child = Node(next, node, action, node.path_cost + cost)
+            if problem.goal_test(next):
+                return child, expanded
+            frontier.append(child)
+    return None, expanded
+
+def iw_search(problem, k=1, features=None):
+    """IW(k); see iw_search_count."""
+    return iw_search_count(problem, k, features)[0]
+
+
+def bfws_search_count(problem, h=None, k=2, features=None, tie=None):
+    """Best-first width search, BFWS(w_h, h): a best-first graph search on
+    (w, h), where w is the novelty of the node (the size of the smallest
+    new tuple of features, k + 1 if none) counted only among the nodes
+    generated with the same h value. Nothing is pruned, so it is complete,
+    but it is not optimal. Returns (node, number of expanded nodes)."""
+    h = memoize(cached_heuristic(problem, h or problem.h), 'h')
+    features = features or problem.features
+    tables = {}
+
+    def f(node):
+        hv = h(node)
+        table = tables.get(hv)
+        if table is None:
+            table = tables[hv] = NoveltyTable(problem.num_features, k)
+        return (table.novelty(features(node.state)), hv)
+
+    stats = {}
+    node = best_first_search(problem, f, stats=stats, tie=tie)
+    return node, stats['expanded']
+
+def bfws_search(problem, h=None, k=2, features=None, tie=None):
+    """BFWS; see bfws_search_count."""
+    return bfws_search_count(problem, h, k, features, tie)[0]
+
 # ______________________________________________________________________________
 # Other search algorithms
 
 
 def recursive_best_first_search(problem, h=None):
     """[Figure 3.26]"""
-    h = memoize(h or problem.h, 'h')
+    h = memoize(cached_heuristic(problem, h or problem.h), 'h')
 
     def RBFS(problem, node, flimit):
         if problem.goal_test(node.state):
@@ -664,6 +1314,112 @@ def recursive_best_first_search(problem, h=None):
     return result
 
 
+class TranspositionTable:
+
+    """The least path cost g at which each state was reached, for at most
+    maxsize states, forgetting the least recently used one. States that
+    cannot be hashed are never remembered."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.costs = collections.OrderedDict()
+        self.hits = 0
+
+    def prune(self, state, g):
+        """Return True if state was already reached at a cost of at most g;
+        otherwise remember g as its cost and return False."""
+        try:
+            known = self.costs.get(state)
+        except TypeError:
+            return False
+        if known is not None and known <= g:
+            self.costs.move_to_end(state)
+            self.hits += 1
+            return True
+        self.costs[state] = g
+        self.costs.move_to_end(state)
+        if len(self.costs) > self.maxsize:
+            self.costs.popitem(last=False)
+        return False
+
+    def clear(self):
+        self.costs.clear()
+
+    def __len__(self):
+        return len(self.costs)
+
+
+def ida_star_search_count(problem, h=None, table_size=None):
+    """IDA*: a series of depth-first searches that prune every node with
+    f = g + h above a bound, the bound of each being the least f pruned in
+    the one before. Memory grows with the depth of the solution only, so it
+    serves where the frontier of A* does not fit. The depth-first search
+    keeps its own stack, so it is not limited by Python's recursion depth,
+    and skips states already on the current path. With table_size, a
+    TranspositionTable of that many states also prunes a state reached
+    again, in the same iteration, at no lower cost. With an admissible h
+    the solution is optimal. Returns (node, expanded), node None if there
+    is no solution, and expanded the list of nodes expanded per iteration."""
+    h = memoize(cached_heuristic(problem, h or problem.h), 'h')
+    table = TranspositionTable(table_size) if table_size else None
+    root = Node(problem.initial)
+    counts = []
+    if problem.goal_test(root.state):
+        return root, counts
+    bound = h(root)
+    while bound != infinity:
+        next_bound = infinity
+        expanded = 1
+        if table is not None:
+            table.clear()
+            table.prune(root.state, 0)
+        path = set()
+        try:
+            path.add(root.state)
+        except TypeError:
+            pass
+        stack = [(root, problem.successors(root.state))]
+        while stack:
+            node, successors = stack[-1]
+            for action, next, cost in successors:
+                try:
+                    if next in path:
+                        continue
+                except TypeError:
+                    pass
+                g = node.path_cost + cost
+                if table is not None and table.prune(next, g):
+                    continue
+                child = Node(next, node, action, g)
+                f = g + h(child)
+                if f > bound:
+                    next_bound = min(next_bound, f)
+                    continue
+                if problem.goal_test(next):
+                    counts.append(expanded)
+                    return child, counts
+                expanded += 1
+                try:
+                    path.add(next)
+                except TypeError:
+                    pass
+                stack.append((child, problem.successors(next)))
+                break
+            else:
+                stack.pop()
+                try:
+                    path.discard(node.state)
+                except TypeError:
+                    pass
+        counts.append(expanded)
+        bound = next_bound
+    return None, counts
+
+def ida_star_search(problem, h=None, table_size=None):
+    """IDA*; see ida_star_search_count."""
+    return ida_star_search_count(problem, h, table_size)[0]
+
+
 def hill_climbing(problem):
     """From the initial node, keep choosing the neighbor with highest value,
     stopping when no neighbor is better. [Figure 4.2]"""
@@ -1169,9 +1925,14 @@ class GraphProblem(Problem):
 
     """The problem of searching a graph from one node to another."""
 
+    incoming = None
+
     def __init__(self, initial, goal, graph):
         Problem.__init__(self, initial, goal)
         self.graph = graph
+        self.integer_costs = all(isinstance(d, int) and d >= 0
+                                 for links in graph.dict.values()
+                                 for d in links.values())
 
     def actions(self, A):
         """The actions at a graph node are just its neighbors."""
@@ -1184,11 +1945,34 @@ class GraphProblem(Problem):
     def path_cost(self, cost_so_far, A, action, B):
         return cost_so_far + (self.graph.get(A, B) or infinity)
 
+    def successors(self, A):
+        """Each neighbor B is reached by action B at the cost of the link."""
+        for B, d in self.graph.get(A).items():
+            yield B, B, d or infinity
+
+    def predecessors(self, B):
+        """B is reached from each A with a link to B, by action B. The links
+        into each node are indexed on the first call, so links added to the
+        graph after that are not seen.
+        >>> p = GraphProblem('Arad', 'Bucharest', romania_map)
+        >>> sorted(A for _, A, _ in p.predecessors('Bucharest'))
+        ['Fagaras', 'Giurgiu', 'Pitesti', 'Urziceni']
+        >>> bidirectional_search(p).path_cost
+        418
+        """
+        if self.incoming is None:
+            self.incoming = defaultdict(dict)
+            for A, links in self.graph.dict.items():
+                for C, d in links.items():
+                    self.incoming[C][A] = d
+        for A, d in self.incoming.get(B, {}).items():
+            yield B, A, d or infinity
+
     def find_min_edge(self):
         """Find minimum value of edges."""
         m = infinity
         for d in self.graph.dict.values():
-            local_min = min(d.values())
+            local_min = min(d.values(), default=infinity)
             m = min(m, local_min)
 
         return m
@@ -1267,6 +2051,17 @@ class NQueensProblem(Problem):
                 row1 - col1 == row2 - col2 or  # same \ diagonal
                 row1 + col1 == row2 + col2)   # same / diagonal
 
+    def successors(self, state):
+        """Like actions and result, but finds the free column only once."""
+        if state[-1] is not None:
+            return
+        col = state.index(None)
+        for row in range(self.N):
+            if not self.conflicted(state, row, col):
+                new = state[:]
+                new[col] = row
+                yield row, new, 1
+
     def goal_test(self, state):
         """Check if all columns filled, no conflicts."""
         if state[-1] is None:
@@ -1486,6 +2281,163 @@ def mutate_boggle(board):
     board[i] = random.choice(random.choice(cubes16))
     return i, oldc
 
+# ______________________________________________________________________________
+# A problem compiled into an explicit graph
+
+
+class CompiledProblem(Problem):
+
+    """The reachable state space of a problem, enumerated once and kept as
+    a graph in compressed sparse row form. The states are interned in
+    states and numbered by ids; the successors of state i are the entries
+    offsets[i] to offsets[i+1] of targets (state ids), action_ids (indices
+    into actions_table) and costs. Goal states are not expanded, as no
+    search goes past them. actions, result, successors, goal_test and
+    path_cost are lookups in these arrays; the states themselves are the
+    original objects, so heuristics written for the original problem work
+    unchanged, and any other attribute is taken from it. The goal is the
+    list of goal states, and predecessors walks the graph backwards, so
+    bidirectional_search can run on it. Raises ValueError if more than
+    limit states are reachable. save and load keep the graph on disk."""
+
+    reverse = None
+
+    def __init__(self, problem, limit=1000000):
+        self.problem = problem
+        self.initial = problem.initial
+        self.integer_costs = problem.integer_costs
+        self.heuristic_cache = problem.heuristic_cache
+        self.states = [problem.initial]
+        self.ids = {problem.initial: 0}
+        self.actions_table = []
+        self.offsets = array('l', [0])
+        self.targets = array('l')
+        self.action_ids = array('l')
+        self.goals = bytearray()
+        action_index = {}
+        costs = []
+        i = 0
+        while i < len(self.states):
+            state = self.states[i]
+            if problem.goal_test(state):
+                self.goals.append(1)
+            else:
+                self.goals.append(0)
+                for action, next, cost in problem.successors(state):
+                    j = self.ids.get(next)
+                    if j is None:
+                        if len(self.states) >= limit:
+                            raise ValueError('more than {} reachable states'.format(limit))
+                        j = self.ids[next] = len(self.states)
+                        self.states.append(next)
+                    a = action_index.get(action)
+                    if a is None:
+                        a = action_index[action] = len(self.actions_table)
+                        self.actions_table.append(action)
+                    self.targets.append(j)
+                    self.action_ids.append(a)
+                    costs.append(cost)
+            self.offsets.append(len(self.targets))
+            i += 1
+        try:
+            self.costs = array('q', costs)
+        except TypeError:
+            self.costs = array('d', costs)
+
+    def __len__(self):
+        return len(self.states)
+
+    def edges(self, state):
+        i = self.ids[state]
+        return range(self.offsets[i], self.offsets[i + 1])
+
+    def actions(self, state):
+        return [self.actions_table[self.action_ids[k]] for k in self.edges(state)]
+
+    def result(self, state, action):
+        for k in self.edges(state):
+            if self.actions_table[self.action_ids[k]] == action:
+                return self.states[self.targets[k]]
+        raise ValueError('{!r} is not an action of {!r}'.format(action, state))
+
+    def successors(self, state):
+        actions_table, states = self.actions_table, self.states
+        for k in self.edges(state):
+            yield actions_table[self.action_ids[k]], states[self.targets[k]], self.costs[k]
+
+    def goal_test(self, state):
+        return self.goals[self.ids[state]] == 1
+
+    @property
+    def goal(self):
+        """The list of the reachable goal states."""
+        return [state for state, goal in zip(self.states, self.goals) if goal]
+
+    def predecessors(self, state):
+        """The edges into state, from the reversed graph, built on first use."""
+        if self.reverse is None:
+            self.reverse = self.reversed_edges()
+        offsets, edges, sources = self.reverse
+        actions_table, states = self.actions_table, self.states
+        i = self.ids[state]
+        for r in range(offsets[i], offsets[i + 1]):
+            k = edges[r]
+            yield actions_table[self.action_ids[k]], states[sources[r]], self.costs[k]
+
+    def reversed_edges(self):
+        """The graph in compressed sparse row form by target: the edges into
+        state j are edges[offsets[j]:offsets[j+1]], indices into targets,
+        coming from the states sources[offsets[j]:offsets[j+1]]."""
+        n = len(self.states)
+        offsets = array('l', [0]) * (n + 1)
+        for j in self.targets:
+            offsets[j + 1] += 1
+        for j in range(n):
+            offsets[j + 1] += offsets[j]
+        fill = array('l', offsets)
+        edges = array('l', [0]) * len(self.targets)
+        sources = array('l', [0]) * len(self.targets)
+        for i in range(n):
+            for k in range(self.offsets[i], self.offsets[i + 1]):
+                r = fill[self.targets[k]]
+                fill[self.targets[k]] += 1
+                edges[r] = k
+                sources[r] = i
+        return offsets, edges, sources
+
+    def path_cost(self, c, state1, action, state2):
+        j = self.ids[state2]
+        for k in self.edges(state1):
+            if self.targets[k] == j and self.actions_table[self.action_ids[k]] == action:
+                return c + self.costs[k]
+        return self.problem.path_cost(c, state1, action, state2)
+
+    def value(self, state):
+        return self.problem.value(state)
+
+    def save(self, path):
+        """Write the graph to the file path; load(path, problem) reads it back."""
+        data = dict(self.__dict__)
+        del data['problem'], data['heuristic_cache']
+        data.pop('reverse', None)
+        with open(path, 'wb') as file:
+            pickle.dump(data, file, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, problem):
+        """Read a graph written by save, compiled from problem."""
+        compiled = cls.__new__(cls)
+        with open(path, 'rb') as file:
+            compiled.__dict__.update(pickle.load(file))
+        compiled.problem = problem
+        compiled.heuristic_cache = problem.heuristic_cache
+        return compiled
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr == 'problem':
+            raise AttributeError(attr)
+        return getattr(self.problem, attr)
+
 # ______________________________________________________________________________
 
 # Code to compare searchers on various problems.
@@ -1497,6 +2449,9 @@ class InstrumentedProblem(Problem):
 
     def __init__(self, problem):
         self.problem = problem
+        self.integer_costs = problem.integer_costs
+        self.prunes_dead_ends = problem.prunes_dead_ends
+        self.prunes_dominated = problem.prunes_dominated
         self.succs = self.goal_tests = self.states = 0
         self.found = None
 
@@ -1518,6 +2473,15 @@ class InstrumentedProblem(Problem):
     def path_cost(self, c, state1, action, state2):
         return self.problem.path_cost(c, state1, action, state2)
 
+    def predecessors(self, state):
+        return self.problem.predecessors(state)
+
+    def dead_end(self, state):
+        return self.problem.dead_end(state)
+
+    def dominance_index(self):
+        return self.problem.dominance_index()
+
     def value(self, state):
         return self.problem.value(state)
 
@@ -1553,6 +2517,49 @@ def compare_graph_searchers():
                               'romania_map(Oradea, Neamt)', 'australia_map'])
 
 
+def optimal_searchers(h=None):
+    """The searches that return a cheapest path, as (name, function of the
+    problem) pairs, using h where they take a heuristic (default problem.h)."""
+    return [('uniform_cost_search_plus', uniform_cost_search_plus),
+            ('astar_search', lambda p: astar_search(p, h)),
+            ('astar_search_plus', lambda p: astar_search_plus(p, h)),
+            ('astar_search reopen', lambda p: best_first_graph_search_plus(
+                p, lambda n: n.path_cost + (h or p.h)(n), reopen=True)),
+            ('lazy_astar_search', lambda p: lazy_astar_search(p, [lambda n: 0, h or p.h])),
+            ('recursive_best_first_search', lambda p: recursive_best_first_search(p, h)),
+            ('ida_star_search', lambda p: ida_star_search(p, h)),
+            ('ida_star_search table', lambda p: ida_star_search(p, h, table_size=10)),
+            ('bidirectional_search', lambda p: bidirectional_search(p, h))]
+
+
+def check_optimal_searchers(problems, searchers=None):
+    """Run each of the searchers (default optimal_searchers()) on each
+    problem and return the (name, problem, cost, expected cost) of those
+    whose path cost differs from that of uniform_cost_search, or whose
+    path does not add up to its cost; None stands for no solution.
+    >>> check_optimal_searchers([GraphProblem('Arad', 'Bucharest', romania_map),
+    ...                          GraphProblem('Oradea', 'Neamt', romania_map),
+    ...                          GraphProblem('Timisoara', 'Giurgiu', romania_map),
+    ...                          GraphProblem('Q', 'WA', australia_map)])
+    []
+    """
+    wrong = []
+    for problem in problems:
+        expected = uniform_cost_search(problem)
+        expected = expected and expected.path_cost
+        for name, search in searchers or optimal_searchers():
+            node = search(problem)
+            cost = node and node.path_cost
+            if node is not None:
+                c = 0
+                for n in node.path()[1:]:
+                    c = problem.path_cost(c, n.parent.state, n.action, n.state)
+                if c != cost or node.path()[0].state != problem.initial:
+                    cost = ('path', c)
+            if cost != expected:
+                wrong.append((name, problem, cost, expected))
+    return wrong
+
 
 
 class EstadoJoaninhas :
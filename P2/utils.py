@@ -7,7 +7,9 @@ import operator
 import os.path
 import random
 import math
+import time
 import functools
+import heapq
 from itertools import chain, combinations
 
 
@@ -668,7 +670,8 @@ class hashabledict(dict):
 
 
 # ______________________________________________________________________________
-# Queues: Stack, FIFOQueue, PriorityQueue
+# Queues: Stack, FIFOQueue, IndexedStack, IndexedFIFOQueue, PriorityQueue,
+# BucketQueue
 
 # TODO: queue.PriorityQueue
 # TODO: Priority queues may not belong here -- see treatment in search.py
@@ -679,7 +682,9 @@ class Queue:
     """Queue is an abstract class/interface. There are three types:
         Stack(): A Last In First Out Queue.
         FIFOQueue(): A First In First Out Queue.
+        IndexedStack(), IndexedFIFOQueue(): the same, with O(1) `in`.
         PriorityQueue(order, f): Queue in sorted order (default min-first).
+        BucketQueue(order, f): PriorityQueue for small integer priorities.
     Each type supports the following methods and functions:
         q.append(item)  -- add an item to the queue
         q.extend(items) -- equivalent to: for item in items: q.append(item)
@@ -734,42 +739,343 @@ class FIFOQueue(Queue):
         return item in self.queue
 
 
+class IndexedQueue(Queue):
+
+    """Abstract base for the FIFO and LIFO queues that keep a Counter of
+    their items next to the items themselves, so that `item in q` is O(1)
+    on average instead of a scan. Search nodes hash and compare by state,
+    so the counter is in effect keyed by node state. Items that cannot be
+    hashed are still accepted and are found by a linear scan."""
+
+    def _count(self, item, delta):
+        try:
+            n = self.counts[item] + delta
+        except TypeError:
+            self.unhashable += delta
+            return
+        if n:
+            self.counts[item] = n
+        else:
+            del self.counts[item]
+
+    def __contains__(self, item):
+        try:
+            return item in self.counts
+        except TypeError:
+            return self.unhashable > 0 and item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+class IndexedStack(IndexedQueue):
+
+    """A Last-In-First-Out Queue with O(1) membership tests."""
+
+    def __init__(self, items=[]):
+        self.items = []
+        self.counts = collections.Counter()
+        self.unhashable = 0
+        self.extend(items)
+
+    def append(self, item):
+        self.items.append(item)
+        self._count(item, 1)
+
+    def pop(self):
+        item = self.items.pop()
+        self._count(item, -1)
+        return item
+
+
+class IndexedFIFOQueue(IndexedQueue):
+
+    """A First-In-First-Out Queue with O(1) membership tests."""
+
+    def __init__(self, maxlen=None, items=[]):
+        self.items = collections.deque(maxlen=maxlen)
+        self.counts = collections.Counter()
+        self.unhashable = 0
+        self.extend(items)
+
+    def append(self, item):
+        if not self.items.maxlen or len(self.items) < self.items.maxlen:
+            self.items.append(item)
+            self._count(item, 1)
+        else:
+            raise Exception('FIFOQueue is full')
+
+    def pop(self):
+        if len(self.items) > 0:
+            item = self.items.popleft()
+            self._count(item, -1)
+            return item
+        else:
+            raise Exception('FIFOQueue is empty')
+
+
+def tie_key(tie, item, counter):
+    """Key that orders items of equal priority, for the counter-th item
+    pushed: tie is 'lifo' (newest first), 'fifo' (oldest first), or a
+    function of the item whose lowest value goes first, with any tie left
+    broken newest first. Counters are unique, so keys never compare items."""
+    if tie == 'lifo':
+        return -counter
+    elif tie == 'fifo':
+        return counter
+    elif callable(tie):
+        return (tie(item), -counter)
+    raise ValueError('unknown tie-breaking policy: {!r}'.format(tie))
+
+
 class PriorityQueue(Queue):
 
     """A queue in which the minimum (or maximum) element (as determined by f and
     order) is returned first. If order is min, the item with minimum f(x) is
     returned first; if order is max, then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
-
-    def __init__(self, order=min, f=lambda x: x):
-        self.A = []
+    Also supports dict-like lookup.
+    The items live in a binary heap, so append and pop are O(log n), and an
+    index from item to its heap entries makes `in`, [] and del O(1) on
+    average. Deleted entries are only flagged and dropped when they reach
+    the top of the heap (lazy deletion).
+    Items with the same f are ordered by the tie policy (see tie_key); by
+    default they are popped newest first for order=min and oldest first
+    for order=max, the order the previous sorted-list implementation gave
+    for search nodes."""
+
+    def __init__(self, order=min, f=lambda x: x, tie=None):
+        self.heap = []
+        self.index = {}
+        self.unhashable = []
         self.order = order
         self.f = f
+        self.tie = tie or ('lifo' if order == min else 'fifo')
+        self.counter = 0
+        self.size = 0
 
     def append(self, item):
-        bisect.insort(self.A, (self.f(item), item))
+        value = self.f(item)
+        self.counter += 1
+        tiebreak = tie_key(self.tie, item, self.counter)
+        if self.order == min:
+            entry = [value, tiebreak, item, True]
+        else:
+            entry = [-value, tiebreak, item, True]
+        heapq.heappush(self.heap, entry)
+        self.size += 1
+        try:
+            self.index.setdefault(item, []).append(entry)
+        except TypeError:
+            self.unhashable.append(entry)
 
     def __len__(self):
-        return len(self.A)
+        return self.size
 
     def pop(self):
-        if self.order == min:
-            return self.A.pop(0)[1]
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[3]:
+                self._forget(entry)
+                return entry[2]
+        raise IndexError('PriorityQueue is empty')
+
+    def _entries(self, key):
+        """Return the live entries whose item equals key."""
+        try:
+            return self.index.get(key, [])
+        except TypeError:
+            return [entry for entry in self.unhashable if entry[2] == key]
+
+    def _forget(self, entry):
+        """Mark entry as removed and drop it from the index."""
+        entry[3] = False
+        self.size -= 1
+        try:
+            entries = self.index[entry[2]]
+        except TypeError:
+            self.unhashable.remove(entry)
+            return
+        entries.remove(entry)
+        if not entries:
+            del self.index[entry[2]]
+
+    def __contains__(self, item):
+        return len(self._entries(item)) > 0
+
+    def __getitem__(self, key):
+        entries = self._entries(key)
+        if entries:
+            return min(entries)[2]
+
+    def __delitem__(self, key):
+        for entry in list(self._entries(key)):
+            self._forget(entry)
+        # rebuild the heap once dead entries outnumber the live ones
+        if len(self.heap) > 2 * self.size + 64:
+            self.heap = [entry for entry in self.heap if entry[3]]
+            heapq.heapify(self.heap)
+
+
+class BucketQueue(Queue):
+
+    """A min-priority queue for non-negative integer priorities, as in
+    Dial's algorithm: bucket p holds the items with f(item) == p, so items of
+    equal priority are pushed and popped in O(1). The buckets are kept in a
+    dict, with a heap of the priorities that have one, so memory grows with
+    the number of distinct priorities queued, not with the largest; when
+    they are few (uniform cost search, A* with a consistent heuristic and
+    small step costs) append and pop are O(1) amortized. Supports the same
+    operations and tie policies as PriorityQueue, with the same default
+    (newest first), so the two can be swapped in a search without changing
+    its result. An infinite priority is also accepted: those items share
+    one last bucket. Any other priority (a float, a negative number) moves
+    every item into a PriorityQueue, keeping their order, and from then on
+    the queue works as that PriorityQueue. With the default policy a bucket
+    is a plain stack; other policies keep each bucket as a small heap.
+    >>> q = BucketQueue(); q.extend([3, 1, 2.5]); [q.pop() for _ in range(3)]
+    [1, 2.5, 3]
+    """
+
+    def __init__(self, order=min, f=lambda x: x, tie=None):
+        if order != min:
+            raise ValueError('BucketQueue only supports order=min')
+        self.buckets = {}
+        self.priorities = []
+        self.index = {}
+        self.size = 0
+        self.f = f
+        self.tie = tie or 'lifo'
+        self.counter = 0
+        self.heap = None
+
+    def append(self, item):
+        if self.heap is not None:
+            return self.heap.append(item)
+        value = self.f(item)
+        try:
+            p = math.inf if value == math.inf else operator.index(value)
+        except TypeError:
+            p = -1
+        if p < 0:
+            self.to_heap()
+            return self.heap.append(item)
+        bucket = self.buckets.get(p)
+        if bucket is None:
+            bucket = self.buckets[p] = []
+            heapq.heappush(self.priorities, p)
+        self.counter += 1
+        if self.tie == 'lifo':
+            entry = [p, item, True, self.counter]
+            bucket.append(entry)
         else:
-            return self.A.pop()[1]
+            entry = [p, item, True, self.counter, tie_key(self.tie, item, self.counter)]
+            heapq.heappush(bucket, (entry[4], entry))
+        self.index.setdefault(item, []).append(entry)
+        self.size += 1
+
+    def to_heap(self):
+        """Move the items to a PriorityQueue with the same f and tie policy,
+        each pushed with the counter it had here, so that items of equal
+        priority keep their order."""
+        heap = PriorityQueue(min, self.f, self.tie)
+        entries = [entry for entries in self.index.values() for entry in entries]
+        for entry in sorted(entries, key=lambda entry: entry[3]):
+            heap.counter = entry[3] - 1
+            heap.append(entry[1])
+        heap.counter = self.counter
+        self.heap = heap
+        self.buckets, self.priorities, self.index = {}, [], {}
+
+    def __len__(self):
+        if self.heap is not None:
+            return len(self.heap)
+        return self.size
+
+    def pop(self):
+        if self.heap is not None:
+            return self.heap.pop()
+        while self.priorities:
+            p = self.priorities[0]
+            bucket = self.buckets[p]
+            while bucket:
+                if self.tie == 'lifo':
+                    entry = bucket.pop()
+                else:
+                    entry = heapq.heappop(bucket)[1]
+                if entry[2]:
+                    self._forget(entry)
+                    return entry[1]
+            heapq.heappop(self.priorities)
+            del self.buckets[p]
+        raise IndexError('BucketQueue is empty')
+
+    def _forget(self, entry):
+        """Mark entry as removed and drop it from the index."""
+        entry[2] = False
+        self.size -= 1
+        entries = self.index[entry[1]]
+        entries[:] = [other for other in entries if other is not entry]
+        if not entries:
+            del self.index[entry[1]]
 
     def __contains__(self, item):
-        return any(item == pair[1] for pair in self.A)
+        if self.heap is not None:
+            return item in self.heap
+        return item in self.index
 
     def __getitem__(self, key):
-        for _, item in self.A:
-            if item == key:
-                return item
+        if self.heap is not None:
+            return self.heap[key]
+        entries = self.index.get(key)
+        if entries:
+            return min(entries, key=lambda entry: entry[0])[1]
 
     def __delitem__(self, key):
-        for i, (value, item) in enumerate(self.A):
-            if item == key:
-                self.A.pop(i)
+        if self.heap is not None:
+            del self.heap[key]
+            return
+        for entry in list(self.index.get(key, [])):
+            self._forget(entry)
+
+
+def compare_queues(n=5000, costs=(1, 2, 3), branching=3, seed=0):
+    """Time a uniform-cost style workload on a sorted list kept with
+    bisect.insort (the old PriorityQueue), on PriorityQueue and on
+    BucketQueue, and print a table with the seconds taken by each.
+    The workload pops the minimum n times and pushes branching successors
+    for each, with a step cost drawn from costs, plus one membership test
+    per push, as a graph search does."""
+
+    def workload(append, pop, contains):
+        rng = random.Random(seed)
+        append((0, 0))
+        ident = 1
+        for _ in range(n):
+            g, _ = pop()
+            for _ in range(branching):
+                child = (g + rng.choice(costs), ident)
+                contains(child)
+                append(child)
+                ident += 1
+
+    def bisect_list():
+        A = []
+        workload(lambda item: bisect.insort(A, (item[0], item)),
+                 lambda: A.pop(0)[1],
+                 lambda item: any(item == pair[1] for pair in A))
+
+    def queue(cls):
+        q = cls(min, lambda item: item[0])
+        workload(q.append, q.pop, q.__contains__)
+
+    table = []
+    for label, run in [('bisect list', bisect_list),
+                       ('PriorityQueue', lambda: queue(PriorityQueue)),
+                       ('BucketQueue', lambda: queue(BucketQueue))]:
+        start = time.perf_counter()
+        run()
+        table.append([label, time.perf_counter() - start])
+    print_table(table, header=['Queue', 'seconds (n={})'.format(n)], numfmt='{:.3f}')
 
 
 # ______________________________________________________________________________